@@ -37,7 +37,6 @@ install_requires = [
     'python-dateutil',
     'PyJWT',
     'requests-oauthlib>=0.3.0',
-    'unidiff>=0.5.4'
 ]
 
 
@@ -1,24 +1,96 @@
 from __future__ import absolute_import
 
+import base64
 import boto3
+import gzip
+import logging
+import six
+import threading
 
+from cached_property import cached_property
 from sentry.plugins.bases.data_forwarding import DataForwardingPlugin
 from sentry.utils import json
 
 from sentry_plugins.base import CorePluginMixin
-from sentry_plugins.utils import get_secret_field_config
+from sentry_plugins.buffer import BatchBuffer, PartialFlushError
+from sentry_plugins.utils import EncodedPayload, get_secret_field_config
+
+logger = logging.getLogger('sentry.plugins.amazon_sqs')
+
+# Amazon doesnt support messages, or batches of messages, larger than 256kb
+MAX_MESSAGE_SIZE = 256 * 1024
+
+# nor more than 10 messages per batch
+MAX_BATCH_COUNT = 10
+
+# the pointer format used by Amazon's extended SQS clients, so that they can
+# transparently fetch payloads we've offloaded to S3
+S3_POINTER_CLASS = 'software.amazon.payloadoffloading.PayloadS3Pointer'
+
+_clients = {}
+_clients_lock = threading.Lock()
 
 
 def get_regions():
     return boto3.session.Session().get_available_regions('sqs')
 
 
+def get_client(access_key, secret_key, region, service_name='sqs'):
+    """
+    Return a cached boto3 client for the given credentials.
+
+    Building a client resolves credentials and loads endpoint data, so we
+    keep one per (service, access key, region) and only replace it when the
+    secret for that access key changes.
+    """
+    key = (service_name, access_key, region)
+    with _clients_lock:
+        cached = _clients.get(key)
+        if cached is not None and cached[0] == secret_key:
+            return cached[1]
+
+        client = boto3.client(
+            service_name=service_name,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+        )
+        _clients[key] = (secret_key, client)
+    return client
+
+
+def clear_clients():
+    with _clients_lock:
+        _clients.clear()
+
+
+def gzip_compress(data):
+    out = six.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def get_entry_size(entry):
+    # message attributes count towards the size limit as well
+    size = len(entry['MessageBody'])
+    for name, attr in six.iteritems(entry.get('MessageAttributes', {})):
+        size += len(name) + len(attr['DataType']) + len(attr['StringValue'])
+    return size
+
+
 class AmazonSQSPlugin(CorePluginMixin, DataForwardingPlugin):
     title = 'Amazon SQS'
     slug = 'amazon-sqs'
     description = 'Forward Sentry events to Amazon SQS.'
     conf_key = 'amazon-sqs'
 
+    # how often failed entries of a batch are resent, backing off
+    # exponentially from batch_retry_delay seconds
+    batch_max_retries = 2
+    batch_retry_delay = 1.0
+    batch_max_delay = 1.0
+
     def get_config(self, project, **kwargs):
         return [
             {
@@ -43,6 +115,32 @@ class AmazonSQSPlugin(CorePluginMixin, DataForwardingPlugin):
                 label='Secret Key',
                 secret=self.get_option('secret_key', project),
             ),
+            {
+                'name': 'batch',
+                'label': 'Batch Events',
+                'type': 'bool',
+                'default': False,
+                'required': False,
+                'help': 'Buffer events and send them to the queue in batches of up to '
+                        '10 messages rather than with one request per event.',
+            },
+            {
+                'name': 's3_bucket',
+                'label': 'S3 Bucket',
+                'type': 'text',
+                'required': False,
+                'placeholder': 'e.g. my-sentry-events',
+                'help': 'Events larger than 256KB are uploaded to this bucket and a '
+                        'pointer to them is sent to the queue instead.',
+            },
+            {
+                'name': 'compress',
+                'label': 'Compress Large Events',
+                'type': 'bool',
+                'default': False,
+                'required': False,
+                'help': 'Gzip events larger than 256KB, both in the queue and in S3.',
+            },
         ]
 
     def forward_event(self, event, payload):
@@ -54,23 +152,112 @@ class AmazonSQSPlugin(CorePluginMixin, DataForwardingPlugin):
         if not all((queue_url, access_key, secret_key, region)):
             return
 
-        # TODO(dcramer): Amazon doesnt support payloads larger than 256kb
-        # We could support this by simply trimming it and allowing upload
-        # to S3
-        message = json.dumps(payload)
-        if len(message) > 256 * 1024:
-            return False
+        message = EncodedPayload(payload)
+        entry = {'MessageBody': message.data}
+        if message.size > MAX_MESSAGE_SIZE:
+            entry = self.get_overflow_entry(event, message)
+            if entry is None:
+                return False
 
-        client = boto3.client(
-            service_name='sqs',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name=region,
-        )
+        if self.get_option('batch', event.project):
+            self.buffer.append(
+                (queue_url, access_key, secret_key, region),
+                entry,
+                size=get_entry_size(entry),
+            )
+            return True
 
+        client = get_client(access_key, secret_key, region)
         client.send_message(
             QueueUrl=queue_url,
-            MessageBody=message,
+            **entry
         )
 
         return True
+
+    def get_overflow_entry(self, event, message):
+        """
+        Returns a message for a payload which is too large to be sent as-is,
+        either by compressing it or by offloading it to S3, or ``None`` if
+        neither is possible.
+        """
+        data = message.data
+        compress = self.get_option('compress', event.project)
+        if compress:
+            data = gzip_compress(data)
+            entry = {
+                'MessageBody': base64.b64encode(data).decode('ascii'),
+                'MessageAttributes': {
+                    'ContentEncoding': {
+                        'DataType': 'String',
+                        'StringValue': 'gzip+base64',
+                    },
+                },
+            }
+            if get_entry_size(entry) <= MAX_MESSAGE_SIZE:
+                return entry
+
+        bucket = self.get_option('s3_bucket', event.project)
+        if not bucket:
+            return None
+
+        key = '{}/{}.json'.format(event.project_id, event.event_id)
+        extra_args = {'ContentType': 'application/json'}
+        if compress:
+            key += '.gz'
+            extra_args['ContentEncoding'] = 'gzip'
+
+        s3 = get_client(
+            self.get_option('access_key', event.project),
+            self.get_option('secret_key', event.project),
+            self.get_option('region', event.project),
+            service_name='s3',
+        )
+        s3.upload_fileobj(six.BytesIO(data), bucket, key, ExtraArgs=extra_args)
+
+        return {
+            'MessageBody': json.dumps([S3_POINTER_CLASS, {
+                's3BucketName': bucket,
+                's3Key': key,
+            }]),
+            'MessageAttributes': {
+                'ExtendedPayloadSize': {
+                    'DataType': 'Number',
+                    'StringValue': six.text_type(message.size),
+                },
+            },
+        }
+
+    @cached_property
+    def buffer(self):
+        return BatchBuffer(
+            self.send_messages,
+            max_count=MAX_BATCH_COUNT,
+            max_bytes=MAX_MESSAGE_SIZE,
+            max_delay=self.batch_max_delay,
+            should_retry=lambda exc: isinstance(exc, PartialFlushError),
+            max_retries=self.batch_max_retries,
+            retry_delay=self.batch_retry_delay,
+        )
+
+    def send_messages(self, key, entries):
+        queue_url, access_key, secret_key, region = key
+        client = get_client(access_key, secret_key, region)
+
+        resp = client.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                dict(entry, Id=six.text_type(idx)) for idx, entry in enumerate(entries)
+            ],
+        )
+        # only entries which failed on Amazon's end are worth resending
+        failed = [f for f in resp.get('Failed', ()) if not f.get('SenderFault')]
+        if len(failed) < len(resp.get('Failed', ())):
+            logger.error('amazon_sqs.batch.rejected', extra={
+                'queue_url': queue_url,
+                'count': len(resp['Failed']) - len(failed),
+            })
+        if failed:
+            # these are usually throttled, so the buffer resends them after
+            # a backoff rather than straight away
+            raise PartialFlushError([entries[int(f['Id'])] for f in failed])
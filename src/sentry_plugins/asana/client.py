@@ -1,11 +1,18 @@
 from __future__ import absolute_import
 
+import re
+
 from sentry_plugins.client import AuthApiClient
 
 
 class AsanaClient(AuthApiClient):
     base_url = u'https://app.asana.com/api/1.0'
 
+    # the workspaces listed in issue forms, other lookups depend on the
+    # issue or the query typed
+    conditional_requests = True
+    conditional_paths = re.compile(r'^/workspaces/?$')
+
     def get_workspaces(self):
         return self.get('/workspaces')
 
@@ -7,8 +7,12 @@ import sys
 
 from sentry.exceptions import InvalidIdentity, PluginError
 
-from sentry_plugins.constants import ERR_INTERNAL, ERR_UNAUTHORIZED, ERR_UNSUPPORTED_RESPONSE_TYPE
-from sentry_plugins.exceptions import ApiError, ApiHostError, ApiUnauthorized, UnsupportedResponseType
+from sentry_plugins.constants import (
+    ERR_INTERNAL, ERR_RATE_LIMITED, ERR_UNAUTHORIZED, ERR_UNSUPPORTED_RESPONSE_TYPE
+)
+from sentry_plugins.exceptions import (
+    ApiError, ApiHostError, ApiRateLimitedError, ApiUnauthorized, UnsupportedResponseType
+)
 
 
 class CorePluginMixin(object):
@@ -34,6 +38,8 @@ class CorePluginMixin(object):
             return ERR_UNAUTHORIZED
         elif isinstance(exc, ApiHostError):
             return exc.text
+        elif isinstance(exc, ApiRateLimitedError):
+            return ERR_RATE_LIMITED
         elif isinstance(exc, UnsupportedResponseType):
             return ERR_UNSUPPORTED_RESPONSE_TYPE.format(
                 content_type=exc.content_type,
@@ -1,17 +1,45 @@
 from __future__ import absolute_import
 
+import copy
+import os
 import six
+import threading
 
 from django.conf import settings
+from multiprocessing.pool import ThreadPool
 from requests_oauthlib import OAuth1
-from unidiff import PatchSet
 
 from sentry_plugins.client import AuthApiClient
 
+# how many commit diffs are fetched at once, across every client of the
+# process
+DIFF_POOL_SIZE = 5
+
+_diff_pool = None
+_diff_pool_pid = None
+_diff_pool_lock = threading.Lock()
+
+
+def get_diff_pool():
+    # a forked worker inherits the pool but none of its threads, so it gets
+    # a pool of its own
+    global _diff_pool, _diff_pool_pid
+    with _diff_pool_lock:
+        if _diff_pool is None or _diff_pool_pid != os.getpid():
+            _diff_pool = ThreadPool(DIFF_POOL_SIZE)
+            _diff_pool_pid = os.getpid()
+        return _diff_pool
+
 
 class BitbucketClient(AuthApiClient):
     base_url = 'https://api.bitbucket.org'
 
+    # the most pages of commits compare_commits will follow, at ~30 a page
+    compare_commits_max_pages = 10
+
+    # the most pages of changed files to read for a single commit
+    diffstat_max_pages = 10
+
     def has_auth(self):
         return (
             self.auth
@@ -75,46 +103,64 @@ class BitbucketClient(AuthApiClient):
             ),
         )
 
-    def transform_patchset(self, patch_set):
-        file_changes = []
-        for patched_file in patch_set.added_files:
-            file_changes.append({
-                'path': patched_file.path,
-                'type': 'A',
-            })
+    def transform_diffstat(self, diffstat):
+        file_changes = {'A': [], 'D': [], 'M': []}
+        for entry in diffstat:
+            status = entry['status']
+            if status == 'added':
+                file_changes['A'].append(entry['new']['path'])
+            elif status == 'removed':
+                file_changes['D'].append(entry['old']['path'])
+            else:
+                # modified, renamed and conflicted files all still exist
+                file_changes['M'].append((entry.get('new') or entry['old'])['path'])
+
+        return [
+            {
+                'path': path,
+                'type': change_type,
+            } for change_type in ('A', 'D', 'M') for path in file_changes[change_type]
+        ]
 
-        for patched_file in patch_set.removed_files:
-            file_changes.append({
-                'path': patched_file.path,
-                'type': 'D',
-            })
+    def get_commit_filechanges(self, repo, sha):
+        # the diffstat only lists the files a commit touched, so we never
+        # have to download the diff itself, see
+        # https://developer.atlassian.com/bitbucket/api/2/reference/resource/repositories/%7Busername%7D/%7Brepo_slug%7D/diffstat/%7Bspec%7D
+        path = '/2.0/repositories/{}/diffstat/{}'.format(repo, sha)
+        diffstat = []
+        for _ in range(self.diffstat_max_pages):
+            data = self.get(path)
+            diffstat.extend(data['values'])
+            # the next link is an absolute url
+            path = data.get('next')
+            if not path:
+                break
 
-        for patched_file in patch_set.modified_files:
-            file_changes.append({
-                'path': patched_file.path,
-                'type': 'M',
-            })
+        return self.transform_diffstat(diffstat)
 
-        return file_changes
+    def zip_commit_data(self, repo, commit_list):
+        if not commit_list:
+            return commit_list
 
-    def get_commit_filechanges(self, repo, sha):
-        # returns unidiff file
+        def get_patch_set(args):
+            client, commit = args
+            return client.get_commit_filechanges(repo, commit['hash'])
 
-        diff_file = self.get(
-            '/2.0/repositories/{}/diff/{}'.format(
-                repo,
-                sha,
-            ),
-            allow_text=True,
+        # every request gets a client, and auth, of its own, as requests
+        # record the rate limit on the client and may refresh its token
+        patch_sets = get_diff_pool().map(
+            get_patch_set, [(self._copy(), commit) for commit in commit_list],
         )
-        ps = PatchSet.from_string(diff_file)
-        return self.transform_patchset(ps)
 
-    def zip_commit_data(self, repo, commit_list):
-        for commit in commit_list:
-            commit.update({'patch_set': self.get_commit_filechanges(repo, commit['hash'])})
+        for commit, patch_set in zip(commit_list, patch_sets):
+            commit.update({'patch_set': patch_set})
         return commit_list
 
+    def _copy(self):
+        client = copy.copy(self)
+        client.auth = copy.deepcopy(self.auth)
+        return client
+
     def get_last_commits(self, repo, end_sha):
         # return api request that fetches last ~30 commits
         # see https://developer.atlassian.com/bitbucket/api/2/reference/resource/repositories/%7Busername%7D/%7Brepo_slug%7D/commits/%7Brevision%7D
@@ -130,13 +176,24 @@ class BitbucketClient(AuthApiClient):
         # where start sha is oldest and end is most recent
         # see
         # https://developer.atlassian.com/bitbucket/api/2/reference/resource/repositories/%7Busername%7D/%7Brepo_slug%7D/commits/%7Brevision%7D
-        data = self.get('/2.0/repositories/{}/commits/{}'.format(repo, end_sha))
+        path = '/2.0/repositories/{}/commits/{}'.format(repo, end_sha)
         commits = []
-        for commit in data['values']:
-            # TODO(maxbittker) fetch extra pages (up to a max) when this is paginated
-            # (more than 30 commits)
-            if commit['hash'] == start_sha:
+        seen = set()
+        for _ in range(self.compare_commits_max_pages):
+            data = self.get(path)
+            new_commits = False
+            for commit in data['values']:
+                if commit['hash'] == start_sha:
+                    return self.zip_commit_data(repo, commits)
+                if commit['hash'] in seen:
+                    continue
+                seen.add(commit['hash'])
+                commits.append(commit)
+                new_commits = True
+
+            # the next link is an absolute url
+            path = data.get('next')
+            if not path or not new_commits:
                 break
-            commits.append(commit)
 
         return self.zip_commit_data(repo, commits)
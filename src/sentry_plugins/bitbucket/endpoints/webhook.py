@@ -7,17 +7,20 @@ import re
 
 import ipaddress
 
-from django.db import IntegrityError, transaction
+from collections import OrderedDict
 from django.http import HttpResponse, Http404
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 from django.utils import timezone
 from simplejson import JSONDecodeError
-from sentry.models import (Commit, CommitAuthor, Organization, Repository)
+from sentry.models import Organization, Repository
 from sentry.plugins.providers import RepositoryProvider
 from sentry.utils import json
 
+from sentry_plugins.bitbucket.tasks import process_webhook_event
+from sentry_plugins.commits import CommitAuthorResolver, bulk_create_commits
+
 logger = logging.getLogger('sentry.webhooks')
 
 # Bitbucket Cloud IP range:
@@ -30,9 +33,12 @@ class Webhook(object):
         raise NotImplementedError
 
 
+# captures content between angle brackets
+_raw_user_email_re = re.compile(r'(?<=<).*(?=>$)')
+
+
 def parse_raw_user_email(raw):
-    # captures content between angle brackets
-    match = re.search('(?<=<).*(?=>$)', raw)
+    match = _raw_user_email_re.search(raw)
     if match is None:
         return
     return match.group(0)
@@ -46,8 +52,6 @@ def parse_raw_user_name(raw):
 class PushEventWebhook(Webhook):
     # https://confluence.atlassian.com/bitbucket/event-payloads-740262817.html#EventPayloads-Push
     def __call__(self, organization, event):
-        authors = {}
-
         try:
             repo = Repository.objects.get(
                 organization_id=organization.id,
@@ -61,41 +65,44 @@ class PushEventWebhook(Webhook):
             repo.config['name'] = event['repository']['full_name']
             repo.save()
 
+        # the changes of a push can overlap, so the same commit may show up
+        # more than once
+        commit_list = OrderedDict()
         for change in event['push']['changes']:
             for commit in change.get('commits', []):
+                if commit['hash'] in commit_list:
+                    continue
                 if RepositoryProvider.should_ignore_commit(commit['message']):
                     continue
-
-                author_email = parse_raw_user_email(commit['author']['raw'])
-
-                # TODO(dcramer): we need to deal with bad values here, but since
-                # its optional, lets just throw it out for now
-                if author_email is None or len(author_email) > 75:
-                    author = None
-                elif author_email not in authors:
-                    authors[author_email] = author = CommitAuthor.objects.get_or_create(
-                        organization_id=organization.id,
-                        email=author_email,
-                        defaults={'name': commit['author']['raw'].split('<')[0].strip()}
-                    )[0]
-                else:
-                    author = authors[author_email]
-                try:
-                    with transaction.atomic():
-
-                        Commit.objects.create(
-                            repository_id=repo.id,
-                            organization_id=organization.id,
-                            key=commit['hash'],
-                            message=commit['message'],
-                            author=author,
-                            date_added=dateutil.parser.parse(
-                                commit['date'],
-                            ).astimezone(timezone.utc),
-                        )
-
-                except IntegrityError:
-                    pass
+                commit_list[commit['hash']] = commit
+
+        # most pushes have a handful of authors, so only parse each once
+        raw_authors = {}
+        resolver = CommitAuthorResolver(organization.id, update_existing=False)
+        for commit in six.itervalues(commit_list):
+            raw = commit['author']['raw']
+            if raw in raw_authors:
+                continue
+            author_email = parse_raw_user_email(raw)
+            # TODO(dcramer): we need to deal with bad values here, but since
+            # its optional, lets just throw it out for now
+            if author_email is not None and len(author_email) > 75:
+                author_email = None
+            raw_authors[raw] = author_email
+            if author_email is not None:
+                resolver.add(author_email, parse_raw_user_name(raw))
+        resolver.resolve()
+
+        bulk_create_commits(organization.id, repo.id, [
+            {
+                'key': commit['hash'],
+                'message': commit['message'],
+                'author': resolver.get(raw_authors[commit['author']['raw']]),
+                'date_added': dateutil.parser.parse(
+                    commit['date'],
+                ).astimezone(timezone.utc),
+            } for commit in six.itervalues(commit_list)
+        ])
 
 
 class BitbucketWebhookEndpoint(View):
@@ -170,5 +177,9 @@ class BitbucketWebhookEndpoint(View):
             )
             return HttpResponse(status=400)
 
-        handler()(organization, event)
-        return HttpResponse(status=204)
+        process_webhook_event.delay(
+            event_type=request.META['HTTP_X_EVENT_KEY'],
+            event=event,
+            organization_id=organization.id,
+        )
+        return HttpResponse(status=202)
@@ -126,6 +126,7 @@ class BitbucketRepositoryProvider(BitbucketMixin, providers.RepositoryProvider):
             raise NotImplementedError('Cannot fetch commits anonymously')
 
         client = self.get_client(actor)
+        client.set_background()
         # use config name because that is kept in sync via webhooks
         name = repo.config['name']
         if start_sha is None:
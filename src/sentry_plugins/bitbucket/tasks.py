@@ -0,0 +1,42 @@
+from __future__ import absolute_import
+
+import logging
+
+from django.http import Http404
+from sentry.models import Organization
+from sentry.tasks.base import instrumented_task, retry
+
+logger = logging.getLogger('sentry.webhooks')
+
+
+@instrumented_task(
+    name='sentry_plugins.bitbucket.tasks.process_webhook_event',
+    queue='commits',
+    default_retry_delay=60 * 5,
+    max_retries=5,
+)
+@retry(exclude=(Http404, Organization.DoesNotExist))
+def process_webhook_event(event_type, event, organization_id, **kwargs):
+    """
+    Runs the handler of a webhook event which the endpoint has already
+    verified. Commits which already exist are skipped, so a delivery can
+    safely be processed more than once.
+    """
+    from sentry_plugins.bitbucket.endpoints.webhook import BitbucketWebhookEndpoint
+
+    handler = BitbucketWebhookEndpoint().get_handler(event_type)
+    if handler is None:
+        return
+
+    organization = Organization.objects.get_from_cache(id=organization_id)
+
+    try:
+        handler()(organization, event)
+    except Http404:
+        logger.info(
+            'bitbucket.webhook.missing-repository',
+            extra={
+                'organization_id': organization_id,
+                'event_type': event_type,
+            }
+        )
@@ -0,0 +1,180 @@
+from __future__ import absolute_import
+
+import atexit
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class PartialFlushError(Exception):
+    """
+    Raised by a flush function which only managed to send some of the items,
+    so that a retry only sends the remaining ``items``.
+    """
+
+    def __init__(self, items, message=None):
+        self.items = items
+        super(PartialFlushError, self).__init__(
+            message or '{} items failed to flush'.format(len(items)),
+        )
+
+
+class Batch(object):
+    def __init__(self, created_at):
+        self.created_at = created_at
+        self.items = []
+        self.size = 0
+        self.attempts = 0
+
+
+class BatchBuffer(object):
+    """
+    An in-process buffer which groups items by key and passes them to
+    ``flush_func(key, items)`` in batches.
+
+    A batch is flushed as soon as it reaches ``max_count`` items or
+    ``max_bytes`` bytes, and otherwise once its oldest item has waited
+    ``max_delay`` seconds. Either way it is sent by a background daemon
+    thread, so callers never wait on the network; ``flush`` sends whatever
+    is left right away.
+
+    If ``should_retry(exc)`` returns true for an error raised while flushing,
+    the batch is handed to the background thread to be sent again after an
+    exponential backoff starting at ``retry_delay``, up to ``max_retries``
+    times, so that callers never wait on a retry. A ``PartialFlushError``
+    narrows the batch down to the items which still need sending.
+    """
+
+    logger = logging.getLogger('sentry.plugins')
+
+    def __init__(self, flush_func, max_count=100, max_bytes=512 * 1024, max_delay=1.0,
+                 should_retry=None, max_retries=3, retry_delay=1.0):
+        self.flush_func = flush_func
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.should_retry = should_retry
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._batches = OrderedDict()
+        # full batches waiting for the background thread
+        self._ready = []
+        self._retries = []
+        # how many batches the background thread is sending right now
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._atexit_registered = False
+
+    def append(self, key, item, size=None):
+        if size is None:
+            size = len(item)
+
+        with self._cond:
+            batch = self._batches.get(key)
+            if batch is not None and batch.items and batch.size + size > self.max_bytes:
+                self._ready.append((key, self._batches.pop(key)))
+                batch = None
+            if batch is None:
+                batch = self._batches[key] = Batch(time.time())
+            batch.items.append(item)
+            batch.size += size
+            if len(batch.items) >= self.max_count or batch.size >= self.max_bytes:
+                self._ready.append((key, self._batches.pop(key)))
+            self._ensure_thread()
+
+    def flush(self, key=None):
+        """
+        Sends every batch of ``key``, or of all keys, including those which
+        are waiting to be retried.
+        """
+        def matches(k):
+            return key is None or k == key
+
+        with self._cond:
+            # let the background thread finish sending first, so that the
+            # batches of a key still go out in order
+            while self._in_flight and self._thread.is_alive():
+                self._cond.wait()
+
+            ready = [(k, b) for _, k, b in self._retries if matches(k)]
+            self._retries = [r for r in self._retries if not matches(r[1])]
+            ready.extend(r for r in self._ready if matches(r[0]))
+            self._ready = [r for r in self._ready if not matches(r[0])]
+            for batch_key in [k for k in self._batches if matches(k)]:
+                ready.append((batch_key, self._batches.pop(batch_key)))
+
+        for batch_key, batch in ready:
+            self._flush_batch(batch_key, batch)
+
+    def _flush_batch(self, key, batch):
+        try:
+            self.flush_func(key, batch.items)
+        except Exception as exc:
+            if isinstance(exc, PartialFlushError):
+                batch.items = list(exc.items)
+            if self.should_retry is not None and batch.attempts < self.max_retries \
+                    and self.should_retry(exc):
+                due = time.time() + self.retry_delay * 2 ** batch.attempts
+                batch.attempts += 1
+                with self._cond:
+                    self._retries.append((due, key, batch))
+                    self._ensure_thread()
+                return
+            self.logger.exception('buffer.flush-failed', extra={
+                'count': len(batch.items),
+                'size': batch.size,
+                'attempts': batch.attempts,
+            })
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            # ``flush`` may be waiting on the condition as well
+            self._cond.notify_all()
+            return
+        # the thread is started again in forked processes, but the buffer
+        # only has to be flushed once at exit
+        self._in_flight = 0
+        self._thread = threading.Thread(target=self._run, name='sentry-plugins-buffer')
+        self._thread.daemon = True
+        self._thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.flush)
+            self._atexit_registered = True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                # full batches don't wait for their delay
+                ready, self._ready = self._ready, []
+                # batches are kept in creation order, so the first one which
+                # isn't due yet tells us how long to sleep
+                timeout = None
+                for key, batch in list(self._batches.items()):
+                    due = batch.created_at + self.max_delay
+                    if due > now:
+                        timeout = due - now
+                        break
+                    ready.append((key, self._batches.pop(key)))
+                for retry in list(self._retries):
+                    due, key, batch = retry
+                    if due > now:
+                        timeout = due - now if timeout is None else min(timeout, due - now)
+                        continue
+                    self._retries.remove(retry)
+                    ready.append((key, batch))
+                if not ready:
+                    self._cond.wait(timeout)
+                    continue
+                self._in_flight += len(ready)
+
+            for key, batch in ready:
+                try:
+                    self._flush_batch(key, batch)
+                finally:
+                    with self._cond:
+                        self._in_flight -= 1
+                        self._cond.notify_all()
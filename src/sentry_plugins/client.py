@@ -1,17 +1,311 @@
 from __future__ import absolute_import
 
+import copy
+import functools
 import logging
 import json
+import os
+import random
 import requests
+import six
+import threading
+import time
 
 from BeautifulSoup import BeautifulStoneSoup
 from cached_property import cached_property
+from collections import OrderedDict
 from django.utils.datastructures import SortedDict
-from requests.exceptions import ConnectionError, HTTPError
+from email.utils import mktime_tz, parsedate_tz
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+from six.moves import http_cookiejar
+from six.moves.urllib.parse import urlparse
 
 from sentry.http import build_session
+from sentry.utils import metrics
+from sentry.utils.hashlib import md5_text
+
+from .exceptions import (
+    ApiHostError, ApiError, ApiRateLimitedError, ApiTimeoutError, ApiUnauthorized,
+    UnsupportedResponseType
+)
+from .utils import CONNECT_TIMEOUT, READ_TIMEOUT, Deadline, DeadlineExceeded, LocalCache
+
+# a C decoder is several times faster on large payloads such as Jira's
+# createmeta, but it can't preserve key order
+try:
+    import ujson
+except ImportError:
+    ujson_loads = None
+else:
+    # older versions round floats unless told not to, newer ones are always
+    # precise and no longer take the flag
+    try:
+        ujson.loads('0', precise_float=True)
+    except TypeError:
+        ujson_loads = ujson.loads
+    else:
+        ujson_loads = functools.partial(ujson.loads, precise_float=True)
+
+
+class BlockAllCookies(http_cookiejar.CookiePolicy):
+    # pooled sessions are shared between clients with different credentials,
+    # so they must never persist cookies from one request to the next
+    return_ok = set_ok = domain_return_ok = path_return_ok = \
+        lambda self, *args, **kwargs: False
+    netscape = True
+    rfc2965 = hide_cookie2 = False
+
+
+class SessionPool(object):
+    """
+    A per-process pool of HTTP sessions, keyed on the host and the transport
+    settings of the caller, so that consecutive requests to the same API
+    reuse their connections instead of paying for a new TCP/TLS handshake.
+
+    ``pool_size`` bounds the number of connections kept per session,
+    ``max_sessions`` the number of sessions kept overall, and sessions which
+    have not been used for ``idle_timeout`` seconds are closed.
+    """
+
+    def __init__(self, pool_size=10, max_sessions=50, idle_timeout=60):
+        self.pool_size = pool_size
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get_key(self, url, verify_ssl=True, proxies=None):
+        parsed = urlparse(url)
+        return (
+            parsed.scheme,
+            parsed.netloc,
+            bool(verify_ssl),
+            tuple(sorted((proxies or {}).items())),
+        )
+
+    def build_session(self):
+        session = build_session()
+        session.cookies.set_policy(BlockAllCookies())
+        # keep whatever adapters sentry mounted (they guard against
+        # requests to internal addresses) but with a larger pool
+        for prefix, adapter in list(session.adapters.items()):
+            session.mount(prefix, type(adapter)(pool_maxsize=self.pool_size))
+        return session
+
+    def get(self, url, verify_ssl=True, proxies=None):
+        key = self.get_key(url, verify_ssl, proxies)
+        now = time.time()
+        self._check_pid()
+        with self._lock:
+            self._evict(now)
+            try:
+                session = self._sessions.pop(key)[0]
+            except KeyError:
+                session = self.build_session()
+            self._sessions[key] = (session, now)
+        return session
+
+    def clear(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, OrderedDict()
+        for session, _ in sessions.values():
+            session.close()
+
+    def _check_pid(self):
+        # the connections of a forked process are shared with its parent, so
+        # a child starts over with a pool of its own
+        pid = os.getpid()
+        if self._pid != pid:
+            self._lock = threading.Lock()
+            self._sessions = OrderedDict()
+            self._pid = pid
+
+    def _evict(self, now):
+        # entries are kept in least-recently-used order. A session evicted to
+        # make room may still be in use by another thread, so it's only
+        # closed once it has been idle for long enough
+        for key, (session, last_used) in list(self._sessions.items()):
+            if now - last_used > self.idle_timeout:
+                del self._sessions[key]
+                session.close()
+            elif len(self._sessions) >= self.max_sessions:
+                del self._sessions[key]
+            else:
+                break
+
+
+session_pool = SessionPool()
+
+
+def parse_retry_after(value, now):
+    # either a number of seconds or an http date
+    try:
+        return now + max(float(value), 0)
+    except ValueError:
+        pass
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
+
+
+class RateLimit(object):
+    """
+    The request budget of a host and credential, as reported by the
+    ``X-RateLimit-*`` (GitHub, Bitbucket), ``RateLimit-*`` (GitLab) and
+    ``Retry-After`` headers of its last response. Any of ``limit``,
+    ``remaining``, ``reset_at`` and ``retry_at`` may be None.
+    """
+
+    def __init__(self, limit=None, remaining=None, reset_at=None, retry_at=None):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+        self.retry_at = retry_at
+
+    def __repr__(self):
+        return u'<RateLimit: remaining=%s/%s, reset_at=%s, retry_at=%s>' % (
+            self.remaining, self.limit, self.reset_at, self.retry_at,
+        )
 
-from .exceptions import ApiHostError, ApiError, ApiUnauthorized, UnsupportedResponseType
+    @classmethod
+    def from_headers(cls, headers, now=None):
+        if now is None:
+            now = time.time()
+
+        def get_int(*names):
+            for name in names:
+                try:
+                    return int(headers[name])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            return None
+
+        reset_at = get_int('X-RateLimit-Reset', 'RateLimit-Reset')
+        # some apis send the number of seconds left rather than a timestamp
+        if reset_at is not None and reset_at < 10 ** 9:
+            reset_at += now
+
+        retry_after = headers.get('Retry-After')
+        rate_limit = cls(
+            limit=get_int('X-RateLimit-Limit', 'RateLimit-Limit'),
+            remaining=get_int('X-RateLimit-Remaining', 'RateLimit-Remaining'),
+            reset_at=reset_at,
+            retry_at=parse_retry_after(retry_after, now) if retry_after else None,
+        )
+        if rate_limit.remaining is None and rate_limit.retry_at is None:
+            return None
+        return rate_limit
+
+    def get_wait(self, reserve=0, now=None):
+        """
+        Returns how many seconds to hold off before the next request.
+        """
+        if now is None:
+            now = time.time()
+        if self.retry_at is not None and self.retry_at > now:
+            return self.retry_at - now
+        if self.remaining is not None and self.remaining <= reserve:
+            if self.reset_at is not None and self.reset_at > now:
+                return self.reset_at - now
+        return 0
+
+
+class RateLimitTracker(object):
+    """
+    Remembers the latest ``RateLimit`` of every host and credential, so that
+    all clients in the process share them.
+    """
+
+    def __init__(self, max_size=1000):
+        self._cache = LocalCache(max_size=max_size)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def update(self, key, response):
+        now = time.time()
+        rate_limit = RateLimit.from_headers(response.headers, now)
+        if rate_limit is None:
+            return None
+        # nothing is worth remembering past the end of the window
+        ttl = max(rate_limit.reset_at or 0, rate_limit.retry_at or 0) - now
+        self._cache.set(key, rate_limit, max(ttl, 1))
+        return rate_limit
+
+    def clear(self):
+        self._cache.clear()
+
+
+rate_limits = RateLimitTracker()
+
+
+class RetryPolicy(object):
+    """
+    Which requests to retry and how long to wait between attempts.
+
+    Only ``methods`` are retried, on connection errors and ``statuses``, up to
+    ``max_retries`` times. The n-th retry waits a random time of up to
+    ``backoff * 2 ** n`` seconds, or until a ``Retry-After`` has passed, and
+    no retry is made which would end after ``deadline`` seconds since the
+    first attempt.
+    """
+
+    def __init__(self, max_retries=2, backoff=0.5, deadline=10,
+                 methods=('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'),
+                 statuses=(429, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.methods = frozenset(methods)
+        self.statuses = frozenset(statuses)
+
+    def get_delay(self, method, attempt, started_at, status_code=None, rate_limit=None):
+        """
+        Returns how long to wait before retrying a failed attempt, or None if
+        it shouldn't be retried. ``status_code`` is None for connection
+        errors.
+        """
+        if method.upper() not in self.methods or attempt >= self.max_retries:
+            return None
+        if status_code is not None and status_code not in self.statuses:
+            return None
+
+        now = time.time()
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if rate_limit is not None:
+            delay = max(delay, rate_limit.get_wait(now=now))
+        if now + delay > started_at + self.deadline:
+            return None
+        return delay
+
+
+# responses of clients which opt into conditional requests, see
+# ``ApiClient.conditional_requests``, bounded by the size of their bodies
+response_cache = LocalCache(max_size=1000, max_bytes=32 * 1024 * 1024)
+
+
+def decode_response_body(response):
+    # ``response.text`` runs charset detection over the whole body when the
+    # Content-Type doesn't declare one, while JSON is UTF-8 by default
+    try:
+        return response.content.decode(response.encoding or 'utf-8')
+    except (LookupError, UnicodeDecodeError):
+        return response.text
+
+
+def loads_json(text, ordered=False):
+    if ordered:
+        return json.loads(text, object_pairs_hook=SortedDict)
+    if ujson_loads is not None:
+        try:
+            return ujson_loads(text)
+        except ValueError:
+            # ujson rejects some valid documents (e.g. very large numbers),
+            # so let the standard decoder have the final say
+            pass
+    return json.loads(text)
 
 
 class BaseApiResponse(object):
@@ -38,32 +332,39 @@ class BaseApiResponse(object):
         return {item['rel']: item['url'] for item in requests.utils.parse_header_links(link_header)}
 
     @classmethod
-    def from_response(self, response, allow_text=False):
+    def from_response(self, response, allow_text=False, ordered=False):
+        """
+        Parses the body of ``response``. JSON objects are decoded to plain
+        dicts unless ``ordered`` is set, in which case they keep the order
+        of their keys.
+        """
+        text = decode_response_body(response)
+
         # XXX(dcramer): this doesnt handle leading spaces, but they're not common
         # paths so its ok
-        if response.text.startswith(u'<?xml'):
-            return XmlApiResponse(response.text, response.headers, response.status_code)
-        elif response.text.startswith('<'):
+        if text.startswith(u'<?xml'):
+            return XmlApiResponse(text, response.headers, response.status_code)
+        elif text.startswith(u'<'):
             if not allow_text:
-                raise ValueError('Not a valid response type: {}'.format(response.text[:128]))
+                raise ValueError('Not a valid response type: {}'.format(text[:128]))
             elif response.status_code < 200 or response.status_code >= 300:
                 raise ValueError('Received unexpected plaintext response for code {}'.format(
                     response.status_code,
                 ))
-            return TextApiResponse(response.text, response.headers, response.status_code)
+            return TextApiResponse(text, response.headers, response.status_code)
 
         # Some APIs will return JSON with an invalid content-type, so we try
         # to decode it anyways
         if 'application/json' not in response.headers['Content-Type']:
             try:
-                data = json.loads(response.text, object_pairs_hook=SortedDict)
+                data = loads_json(text, ordered)
             except (TypeError, ValueError):
                 if allow_text:
-                    return TextApiResponse(response.text, response.headers, response.status_code)
+                    return TextApiResponse(text, response.headers, response.status_code)
                 raise UnsupportedResponseType(
                     response.headers['Content-Type'], response.status_code)
         else:
-            data = json.loads(response.text, object_pairs_hook=SortedDict)
+            data = loads_json(text, ordered)
 
         if isinstance(data, dict):
             return MappingApiResponse(data, response.headers, response.status_code)
@@ -110,8 +411,51 @@ class ApiClient(object):
 
     allow_text = False
 
+    # decode JSON objects to ordered dicts, for APIs where key order matters
+    ordered_json = False
+
     allow_redirects = None
 
+    proxies = None
+
+    # subclasses may provide their own pool to tune its size or timeouts
+    session_pool = session_pool
+
+    # when enabled, GET responses carrying an ETag or Last-Modified header
+    # are kept for ``conditional_cache_ttl`` seconds and revalidated with
+    # If-None-Match/If-Modified-Since, so unchanged resources come back as
+    # a bodyless 304
+    conditional_requests = False
+    # when set, only GETs of paths matching this pattern are cached
+    conditional_paths = None
+    conditional_cache_ttl = 60 * 60
+    # in bytes, larger bodies aren't worth holding on to
+    conditional_cache_max_size = 256 * 1024
+    response_cache = response_cache
+
+    # the budget reported by the last response, see ``RateLimit``
+    rate_limit = None
+    rate_limits = rate_limits
+
+    # background work (fetching commits, webhooks) should call
+    # ``set_background`` to clear this, so that it holds off before the rate
+    # limit runs out instead of eating into what's left for users
+    interactive = True
+    rate_limit_reserve = 10
+    max_rate_limit_wait = 30
+
+    # set to None to never retry
+    retry_policy = RetryPolicy()
+
+    # in seconds, for each attempt of a request
+    connect_timeout = CONNECT_TIMEOUT
+    read_timeout = READ_TIMEOUT
+
+    # set to a ``Deadline`` to bound every request made for an operation
+    deadline = None
+    # how long background work may take altogether, see ``set_background``
+    background_timeout = 120
+
     logger = logging.getLogger('sentry.plugins')
 
     def __init__(self, verify_ssl=True):
@@ -125,11 +469,15 @@ class ApiClient(object):
         return path
 
     def _request(self, method, path, headers=None, data=None, params=None,
-                 auth=None, json=True, allow_text=None, allow_redirects=None):
+                 auth=None, json=True, allow_text=None, allow_redirects=None,
+                 ordered_json=None):
 
         if allow_text is None:
             allow_text = self.allow_text
 
+        if ordered_json is None:
+            ordered_json = self.ordered_json
+
         if allow_redirects is None:
             allow_redirects = self.allow_redirects
 
@@ -137,34 +485,234 @@ class ApiClient(object):
             allow_redirects = method.upper() == 'GET'
 
         full_url = self.build_url(path)
-        session = build_session()
-        try:
-            resp = getattr(session, method.lower())(
-                url=full_url,
-                headers=headers,
-                json=data if json else None,
-                data=data if not json else None,
-                params=params,
-                auth=auth,
-                verify=self.verify_ssl,
-                allow_redirects=allow_redirects,
+
+        cache_key = None
+        cached = None
+        if self.should_cache(method, path):
+            cache_key = self.get_cache_key(full_url, params, headers, auth)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                headers = dict(headers or {})
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+        rate_limit_key = self.get_rate_limit_key(full_url, headers, auth)
+        host = rate_limit_key[0]
+        started_at = time.time()
+        attempt = 0
+        while True:
+            self.wait_for_rate_limit(rate_limit_key)
+            timeout = self.get_timeout(full_url)
+
+            session = self.session_pool.get(
+                full_url,
+                verify_ssl=self.verify_ssl,
+                proxies=self.proxies,
+            )
+            try:
+                resp = getattr(session, method.lower())(
+                    url=full_url,
+                    headers=headers,
+                    json=data if json else None,
+                    data=data if not json else None,
+                    params=params,
+                    auth=auth,
+                    verify=self.verify_ssl,
+                    proxies=self.proxies,
+                    allow_redirects=allow_redirects,
+                    timeout=timeout,
+                )
+                resp.raise_for_status()
+            except ConnectionError as e:
+                delay = self.get_retry_delay(method, attempt, started_at)
+                if delay is None:
+                    self.record_attempts(host, attempt, 'connection-error')
+                    raise ApiHostError.from_exception(e)
+                reason = 'connection-error'
+            except Timeout as e:
+                # the request may have been processed, so we don't retry it
+                self.record_attempts(host, attempt, 'timeout')
+                raise ApiTimeoutError.from_exception(e)
+            except HTTPError as e:
+                resp = e.response
+                if resp is None:
+                    self.logger.exception('request.error', extra={
+                        'url': full_url,
+                    })
+                    raise ApiError('Internal Error')
+                self.rate_limit = self.rate_limits.update(rate_limit_key, resp)
+                delay = self.get_retry_delay(
+                    method, attempt, started_at, resp.status_code, self.rate_limit,
+                )
+                if delay is None:
+                    self.record_attempts(host, attempt, resp.status_code)
+                    raise ApiError.from_response(resp)
+                reason = resp.status_code
+            else:
+                self.record_attempts(host, attempt, resp.status_code)
+                break
+
+            metrics.incr('sentry-plugins.http_request.retry', tags={
+                'host': host,
+                'reason': reason,
+            })
+            time.sleep(delay)
+            attempt += 1
+
+        self.rate_limit = self.rate_limits.update(rate_limit_key, resp)
+
+        if resp.status_code == 304 and cached is not None:
+            # callers are free to modify what we give them
+            return cached['cls'](
+                copy.deepcopy(cached['data']), cached['headers'], cached['status_code'],
             )
-            resp.raise_for_status()
-        except ConnectionError as e:
-            raise ApiHostError.from_exception(e)
-        except HTTPError as e:
-            resp = e.response
-            if resp is None:
-                self.logger.exception('request.error', extra={
-                    'url': full_url,
-                })
-                raise ApiError('Internal Error')
-            raise ApiError.from_response(resp)
 
         if resp.status_code == 204:
             return {}
 
-        return BaseApiResponse.from_response(resp, allow_text=allow_text)
+        result = BaseApiResponse.from_response(
+            resp, allow_text=allow_text, ordered=ordered_json,
+        )
+        if cache_key is not None:
+            self.cache_response(cache_key, resp, result)
+        return result
+
+    def set_background(self):
+        """
+        Marks the client as doing work nobody is waiting on, such as fetching
+        the commits of a release, which has ``background_timeout`` seconds
+        to finish.
+        """
+        self.interactive = False
+        self.deadline = Deadline(self.background_timeout)
+
+    def get_timeout(self, full_url):
+        if self.deadline is None:
+            return (self.connect_timeout, self.read_timeout)
+        try:
+            return self.deadline.get_timeout(self.connect_timeout, self.read_timeout)
+        except DeadlineExceeded:
+            raise ApiTimeoutError(
+                'Timed out waiting for host: {}'.format(urlparse(full_url).netloc),
+            )
+
+    def get_retry_delay(self, method, attempt, started_at, status_code=None, rate_limit=None):
+        if self.retry_policy is None:
+            return None
+        delay = self.retry_policy.get_delay(method, attempt, started_at, status_code, rate_limit)
+        if delay is not None and self.deadline is not None \
+                and delay >= self.deadline.remaining():
+            return None
+        return delay
+
+    def record_attempts(self, host, retries, result):
+        # only requests which needed retrying are interesting
+        if not retries:
+            return
+        metrics.timing('sentry-plugins.http_request.attempts', retries + 1, tags={
+            'host': host,
+            'result': result,
+        })
+
+    def get_auth_identity(self, headers, auth):
+        """
+        Returns a hash of the credentials of a request, or None if they
+        can't be told apart.
+        """
+        if auth is None:
+            identity = ()
+        elif isinstance(auth, tuple):
+            identity = auth
+        elif getattr(auth, 'client', None) is not None:
+            # OAuth1
+            identity = (auth.client.client_key, auth.client.resource_owner_key)
+        else:
+            return None
+
+        return md5_text((headers or {}).get('Authorization', ''), *identity).hexdigest()
+
+    def should_cache(self, method, path):
+        if not self.conditional_requests or method.upper() != 'GET':
+            return False
+        return self.conditional_paths is None or bool(self.conditional_paths.match(path))
+
+    def get_cache_key(self, full_url, params, headers, auth):
+        """
+        Returns the key a GET request is cached under, or None if the caller
+        can't be identified. The key covers the credentials of the request
+        so that one user's responses are never served to another.
+        """
+        identity = self.get_auth_identity(headers, auth)
+        if identity is None:
+            return None
+
+        return u'plugins:response:{}'.format(md5_text(
+            full_url,
+            repr(sorted(six.iteritems(params or {}))),
+            identity,
+        ).hexdigest())
+
+    def get_rate_limit_key(self, full_url, headers, auth):
+        # budgets are per host and credential, requests whose credentials we
+        # can't identify share one per host
+        return (urlparse(full_url).netloc, self.get_auth_identity(headers, auth))
+
+    def wait_for_rate_limit(self, rate_limit_key):
+        """
+        Waits until the budget of a request allows it to be sent, or raises
+        ApiRateLimitedError if that would take longer than we're allowed to
+        wait. Interactive requests never wait and only give up once the
+        budget is gone; others stop ``rate_limit_reserve`` requests early
+        so that there's always some budget left for users.
+        """
+        rate_limit = self.rate_limits.get(rate_limit_key)
+        if rate_limit is None:
+            return
+
+        if self.interactive:
+            wait = rate_limit.get_wait(reserve=0)
+            max_wait = 0
+        else:
+            wait = rate_limit.get_wait(reserve=self.rate_limit_reserve)
+            max_wait = self.max_rate_limit_wait
+            if self.deadline is not None:
+                max_wait = min(max_wait, self.deadline.remaining())
+        if wait <= 0:
+            return
+
+        if wait > max_wait:
+            self.logger.info('request.rate-limited', extra={
+                'host': rate_limit_key[0],
+                'wait': wait,
+            })
+            raise ApiRateLimitedError(
+                'Rate limited by {}, retry in {} seconds'.format(rate_limit_key[0], int(wait)),
+            )
+        time.sleep(wait)
+
+    def cache_response(self, cache_key, resp, result):
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+        if not (etag or last_modified):
+            return
+        size = len(resp.content)
+        if size > self.conditional_cache_max_size:
+            return
+        if not isinstance(result, (MappingApiResponse, SequenceApiResponse)):
+            return
+        self.response_cache.set(cache_key, {
+            'etag': etag,
+            'last_modified': last_modified,
+            'cls': type(result),
+            'data': copy.deepcopy(
+                dict(result) if isinstance(result, dict) else list(result),
+            ),
+            'headers': result.headers,
+            'status_code': result.status_code,
+        }, self.conditional_cache_ttl, size=size)
 
     # subclasses should override ``request``
     def request(self, *args, **kwargs):
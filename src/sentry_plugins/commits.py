@@ -0,0 +1,235 @@
+from __future__ import absolute_import
+
+import logging
+import six
+
+from collections import OrderedDict
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, F, Value, When
+from sentry.models import Commit, CommitAuthor, CommitFileChange
+
+logger = logging.getLogger('sentry.plugins')
+
+
+def bulk_create_commits(organization_id, repository_id, commits, attempts=3):
+    """
+    Creates the commits of a push, along with their file changes, using a
+    handful of queries regardless of how many commits there are.
+
+    Each commit is a dict of ``key``, ``message``, ``author``, ``date_added``
+    and optionally ``file_changes``, a list of ``(filename, type)`` tuples.
+    Commits which already exist in the repository are skipped. Returns the
+    keys of the commits which were created.
+    """
+    # the same commit may show up more than once in a single push
+    commits_by_key = OrderedDict()
+    for commit in commits:
+        commits_by_key.setdefault(commit['key'], commit)
+
+    for _ in range(attempts):
+        existing = set(
+            Commit.objects.filter(
+                repository_id=repository_id,
+                key__in=list(commits_by_key),
+            ).values_list('key', flat=True)
+        )
+        new_commits = [c for k, c in six.iteritems(commits_by_key) if k not in existing]
+        if not new_commits:
+            return []
+
+        try:
+            with transaction.atomic():
+                _create_commits(organization_id, repository_id, new_commits)
+        except IntegrityError:
+            # another delivery of the same push got there first, so look up
+            # what exists now and try again with the rest
+            continue
+        return [c['key'] for c in new_commits]
+
+    logger.error('commits.bulk-create-failed', extra={
+        'organization_id': organization_id,
+        'repository_id': repository_id,
+    })
+    return []
+
+
+def _create_commits(organization_id, repository_id, commits):
+    Commit.objects.bulk_create([
+        Commit(
+            organization_id=organization_id,
+            repository_id=repository_id,
+            key=c['key'],
+            message=c['message'],
+            author=c['author'],
+            date_added=c['date_added'],
+        ) for c in commits
+    ])
+
+    # bulk_create doesn't give us the ids of the new rows
+    commit_ids = dict(
+        Commit.objects.filter(
+            repository_id=repository_id,
+            key__in=[c['key'] for c in commits],
+        ).values_list('key', 'id')
+    )
+
+    file_changes = []
+    for c in commits:
+        seen = set()
+        for filename, change_type in c.get('file_changes') or ():
+            if filename in seen:
+                continue
+            seen.add(filename)
+            file_changes.append(
+                CommitFileChange(
+                    organization_id=organization_id,
+                    commit_id=commit_ids[c['key']],
+                    filename=filename,
+                    type=change_type,
+                )
+            )
+    if file_changes:
+        CommitFileChange.objects.bulk_create(file_changes)
+
+
+class CommitAuthorResolver(object):
+    """
+    Resolves the ``CommitAuthor`` of every email in a push with a fixed
+    number of queries: one to load the existing authors, one to create the
+    missing ones and one to update the details of those which changed.
+
+    Register each author with ``add`` before calling ``resolve``; the first
+    name and external id given for an email win. Unless ``update_existing``
+    is false, existing authors get their name and external id updated to
+    match.
+    """
+
+    def __init__(self, organization_id, update_existing=True):
+        self.organization_id = organization_id
+        self.update_existing = update_existing
+        self.authors = {}
+        self._pending = OrderedDict()
+
+    def load_external_ids(self, external_ids):
+        if not external_ids:
+            return {}
+        return {
+            a.external_id: a for a in CommitAuthor.objects.filter(
+                organization_id=self.organization_id,
+                external_id__in=list(external_ids),
+            )
+        }
+
+    def add(self, email, name, external_id=None):
+        if email not in self.authors and email not in self._pending:
+            self._pending[email] = (name, external_id)
+
+    def set(self, email, author):
+        self._pending.pop(email, None)
+        self.authors[email] = author
+
+    def get(self, email):
+        return self.authors.get(email)
+
+    def resolve(self):
+        pending, self._pending = self._pending, OrderedDict()
+        if not pending:
+            return self.authors
+
+        existing = {
+            a.email: a for a in CommitAuthor.objects.filter(
+                organization_id=self.organization_id,
+                email__in=list(pending),
+            )
+        }
+        missing = [email for email in pending if email not in existing]
+        if missing:
+            existing.update(self._create(missing, pending))
+
+        changes = []
+        for email, (name, external_id) in six.iteritems(pending):
+            author = existing.get(email)
+            if author is None:
+                continue
+            self.authors[email] = author
+            if not self.update_existing:
+                continue
+
+            update_kwargs = {}
+            if author.name != name:
+                update_kwargs['name'] = name
+            if external_id and author.external_id != external_id:
+                update_kwargs['external_id'] = external_id
+            if update_kwargs:
+                changes.append((author, update_kwargs))
+
+        if changes:
+            try:
+                with transaction.atomic():
+                    self._update(changes)
+            except IntegrityError:
+                # one of the external ids belongs to another author already,
+                # so only the names can be updated
+                changes = [(a, {'name': v['name']}) for a, v in changes if 'name' in v]
+                if changes:
+                    self._update(changes)
+            for author, values in changes:
+                for key, value in six.iteritems(values):
+                    setattr(author, key, value)
+
+        return self.authors
+
+    def _update(self, changes):
+        fields = {}
+        for key in ('name', 'external_id'):
+            whens = [
+                When(id=author.id, then=Value(values[key]))
+                for author, values in changes if key in values
+            ]
+            if whens:
+                fields[key] = Case(*whens, default=F(key), output_field=CharField())
+        CommitAuthor.objects.filter(
+            id__in=[author.id for author, _ in changes],
+        ).update(**fields)
+
+    def _create(self, emails, pending):
+        try:
+            with transaction.atomic():
+                CommitAuthor.objects.bulk_create([
+                    CommitAuthor(
+                        organization_id=self.organization_id,
+                        email=email,
+                        name=pending[email][0],
+                        external_id=pending[email][1],
+                    ) for email in emails
+                ])
+        except IntegrityError:
+            # someone else created some of them in the meantime, or one of the
+            # external ids is already taken
+            return {email: self._get_or_create(email, *pending[email]) for email in emails}
+
+        # bulk_create doesn't give us the ids of the new rows
+        return {
+            a.email: a for a in CommitAuthor.objects.filter(
+                organization_id=self.organization_id,
+                email__in=emails,
+            )
+        }
+
+    def _get_or_create(self, email, name, external_id):
+        defaults = {'name': name, 'external_id': external_id}
+        try:
+            with transaction.atomic():
+                return CommitAuthor.objects.get_or_create(
+                    organization_id=self.organization_id,
+                    email=email,
+                    defaults=defaults,
+                )[0]
+        except IntegrityError:
+            # the external id belongs to another author already
+            del defaults['external_id']
+            return CommitAuthor.objects.get_or_create(
+                organization_id=self.organization_id,
+                email=email,
+                defaults=defaults,
+            )[0]
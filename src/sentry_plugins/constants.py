@@ -14,3 +14,7 @@ ERR_UNAUTHORIZED = (
 ERR_UNSUPPORTED_RESPONSE_TYPE = (
     'An unsupported response type was returned: {content_type}'
 )
+
+ERR_RATE_LIMITED = (
+    'The rate limit for this service has been reached, please try again later'
+)
@@ -35,6 +35,8 @@ class ApiError(Exception):
     def from_response(cls, response):
         if response.status_code == 401:
             return ApiUnauthorized(response.text)
+        elif response.status_code == 429:
+            return ApiRateLimitedError(response.text)
         return cls(response.text, response.status_code)
 
 
@@ -53,10 +55,23 @@ class ApiHostError(ApiError):
         return cls('Unable to reach host: {}'.format(host))
 
 
+class ApiTimeoutError(ApiHostError):
+    code = 504
+
+    @classmethod
+    def from_request(cls, request):
+        host = urlparse(request.url).netloc
+        return cls('Timed out waiting for host: {}'.format(host))
+
+
 class ApiUnauthorized(ApiError):
     code = 401
 
 
+class ApiRateLimitedError(ApiError):
+    code = 429
+
+
 class UnsupportedResponseType(ApiError):
     @property
     def content_type(self):
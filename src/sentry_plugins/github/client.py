@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import calendar
 import datetime
 import jwt
+import re
 import time
 
 from django.conf import settings
@@ -16,25 +17,55 @@ class GitHubClientMixin(AuthApiClient):
 
     base_url = 'https://api.github.com'
 
+    # github doesn't count 304s against the rate limit. Only repository and
+    # assignee lookups are repeated often enough to be worth caching, the
+    # pages of commits are large and rarely fetched twice
+    conditional_requests = True
+    conditional_paths = re.compile(r'^/repos/[^/]+/[^/]+(/assignees)?(\?|$)')
+
+    # the most pages get_last_commits and compare_commits will follow
+    max_commit_pages = 20
+
+    def get_pages(self, path, params=None, max_pages=None):
+        # follows the Link headers of a paginated endpoint, see
+        # https://developer.github.com/v3/#pagination
+        if max_pages is None:
+            max_pages = self.max_commit_pages
+        for _ in range(max_pages):
+            res = self.get(path, params=params)
+            yield res
+            path = res.rel.get('next')
+            if not path:
+                return
+            # the next url already has the query string
+            params = None
+
+        # whatever comes after the last page we fetched is dropped
+        self.logger.warning('github.pages-truncated', extra={
+            'next': path,
+            'max_pages': max_pages,
+        })
+
     def get_last_commits(self, repo, end_sha):
-        # return api request that fetches last ~30 commits
+        # yields the commits leading up to end_sha, newest first, fetching
+        # another page of ~30 commits whenever the last one runs out
         # see https://developer.github.com/v3/repos/commits/#list-commits-on-a-repository
         # using end_sha as parameter
-        return self.get(
-            '/repos/{}/commits'.format(
-                repo,
-            ),
-            params={'sha': end_sha},
-        )
+        for page in self.get_pages('/repos/{}/commits'.format(repo), params={'sha': end_sha}):
+            for commit in page:
+                yield commit
 
     def compare_commits(self, repo, start_sha, end_sha):
+        # yields the commits between the two shas, a page of up to 250 at a time
         # see https://developer.github.com/v3/repos/commits/#compare-two-commits
         # where start sha is oldest and end is most recent
-        return self.get('/repos/{}/compare/{}...{}'.format(
+        for page in self.get_pages('/repos/{}/compare/{}...{}'.format(
             repo,
             start_sha,
             end_sha,
-        ))
+        )):
+            for commit in page['commits']:
+                yield commit
 
     def get_pr_commits(self, repo, num):
         # see https://developer.github.com/v3/pulls/#list-commits-on-a-pull-request
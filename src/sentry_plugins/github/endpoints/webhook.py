@@ -6,7 +6,9 @@ import hmac
 import logging
 import six
 
+from collections import OrderedDict
 from django.db import IntegrityError, transaction
+from django.db.models import Case, Value, When
 from django.http import HttpResponse, Http404
 from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
@@ -16,17 +18,25 @@ from django.utils import timezone
 from simplejson import JSONDecodeError
 from sentry import options
 from sentry.models import (
-    Commit, CommitAuthor, CommitFileChange, Integration, Organization, OrganizationOption,
-    Repository, User, PullRequest
+    CommitAuthor, Integration, Organization, OrganizationOption, Repository, User, PullRequest
 )
 from sentry.plugins.providers import RepositoryProvider
 from sentry.utils import json
+from sentry.utils.cache import cache
+from sentry.utils.hashlib import md5_text
 
+from sentry_plugins.commits import CommitAuthorResolver, bulk_create_commits
 from sentry_plugins.exceptions import ApiError
 from sentry_plugins.github.client import GitHubClient
+from sentry_plugins.github.tasks import process_webhook_event
 
 logger = logging.getLogger('sentry.webhooks')
 
+# how long to remember the sentry user email of a github username, and how
+# long to remember that a username doesn't belong to anyone in the org
+USER_EMAIL_TTL = 24 * 60 * 60
+USER_EMAIL_NEGATIVE_TTL = 60 * 60
+
 
 def is_anonymous_email(email):
     return email[-25:] == '@users.noreply.github.com'
@@ -36,6 +46,13 @@ def get_external_id(username):
     return 'github:%s' % username
 
 
+def get_user_email_cache_key(organization_id, gh_username):
+    return u'github:user-email:{}:{}'.format(
+        organization_id,
+        md5_text(gh_username).hexdigest(),
+    )
+
+
 class Webhook(object):
     def __call__(self, event, organization=None):
         raise NotImplementedError
@@ -72,52 +89,144 @@ class InstallationRepositoryEventWebhook(Webhook):
         repos_added = event['repositories_added']
 
         if repos_added:
-            for org_id in integration.organizations.values_list('id', flat=True):
-                for r in repos_added:
-                    config = {
-                        'name': r['full_name'],
-                    }
-                    repo, created = Repository.objects.get_or_create(
+            self._add_repositories(
+                integration,
+                list(integration.organizations.values_list('id', flat=True)),
+                repos_added,
+            )
+        # TODO(jess): what do we want to do when they're removed?
+        # maybe signify that we've lost access but not deleted?
+
+    def _add_repositories(self, integration, org_ids, repos_added):
+        repos_by_id = OrderedDict(
+            (six.text_type(r['id']), r) for r in repos_added
+        )
+        existing = {
+            (r.organization_id, r.external_id): r for r in Repository.objects.filter(
+                organization_id__in=org_ids,
+                provider='github',
+                external_id__in=list(repos_by_id),
+            )
+        }
+
+        missing = []
+        renamed = []
+        for org_id in org_ids:
+            for external_id, r in six.iteritems(repos_by_id):
+                repo = existing.get((org_id, external_id))
+                if repo is None:
+                    missing.append(Repository(
                         organization_id=org_id,
                         name=r['full_name'],
                         provider='github',
-                        external_id=r['id'],
-                        defaults={
-                            'url': 'https://github.com/%s' % (r['full_name'], ),
-                            'config': config,
-                            'integration_id': integration.id,
-                        }
-                    )
-                    if not created:
-                        repo.config.update(config)
-                        repo.integration_id = integration.id
-                        repo.save()
-        # TODO(jess): what do we want to do when they're removed?
-        # maybe signify that we've lost access but not deleted?
+                        external_id=external_id,
+                        url='https://github.com/%s' % (r['full_name'], ),
+                        config={'name': r['full_name']},
+                        integration_id=integration.id,
+                    ))
+                elif repo.config.get('name') != r['full_name']:
+                    repo.config['name'] = r['full_name']
+                    renamed.append(repo)
+
+        if missing:
+            try:
+                with transaction.atomic():
+                    Repository.objects.bulk_create(missing)
+            except IntegrityError:
+                # some of them were created in the meantime, or clash with
+                # another repository of the same name
+                for repo in missing:
+                    try:
+                        with transaction.atomic():
+                            repo.save()
+                    except IntegrityError:
+                        pass
 
+        if renamed:
+            # the config differs from one repository to the next
+            config_field = Repository._meta.get_field('config')
+            Repository.objects.filter(id__in=[r.id for r in renamed]).update(
+                config=Case(
+                    *[
+                        When(id=r.id, then=Value(r.config, output_field=config_field))
+                        for r in renamed
+                    ],
+                    output_field=config_field
+                ),
+            )
 
-class PushEventWebhook(Webhook):
-    def _handle(self, event, organization, is_apps):
-        authors = {}
+        stale_ids = [r.id for r in six.itervalues(existing) if r.integration_id != integration.id]
+        if stale_ids:
+            Repository.objects.filter(id__in=stale_ids).update(integration_id=integration.id)
 
-        client = GitHubClient()
-        gh_username_cache = {}
 
-        try:
-            repo = Repository.objects.get(
-                organization_id=organization.id,
-                provider='github_apps' if is_apps else 'github',
-                external_id=six.text_type(event['repository']['id']),
-            )
-        except Repository.DoesNotExist:
-            raise Http404()
+class PushEventWebhook(Webhook):
+    def _find_user_email(self, client, organization, gh_username, gh_users):
+        # usernames which don't belong to anyone in the org are cached as an
+        # empty string, failed lookups aren't cached at all
+        cache_key = get_user_email_cache_key(organization.id, gh_username)
+        email = cache.get(cache_key)
+        if email is not None:
+            return email or None
+
+        # the github user is the same for every organization of a push
+        if gh_username not in gh_users:
+            try:
+                gh_users[gh_username] = client.request_no_auth('GET', '/users/%s' % gh_username)
+            except ApiError as exc:
+                logger.exception(six.text_type(exc))
+                gh_users[gh_username] = None
+        gh_user = gh_users[gh_username]
+        if gh_user is None:
+            return None
 
-        # We need to track GitHub's "full_name" which is the repository slug.
-        # This is needed to access the API since `external_id` isn't sufficient.
-        if repo.config.get('name') != event['repository']['full_name']:
-            repo.config['name'] = event['repository']['full_name']
-            repo.save()
+        try:
+            email = User.objects.filter(
+                social_auth__provider='github',
+                social_auth__uid=gh_user['id'],
+                org_memberships=organization,
+            )[0].email
+        except IndexError:
+            email = ''
+        cache.set(cache_key, email, USER_EMAIL_TTL if email else USER_EMAIL_NEGATIVE_TTL)
+        return email or None
+
+    def _resolve_anonymous_emails(self, organization, resolver, gh_usernames, gh_users):
+        # try to figure out who anonymous emails are, returning the email
+        # and known author of each username
+        client = GitHubClient()
+        client.set_background()
+        known_authors = resolver.load_external_ids(
+            [get_external_id(gh_username) for gh_username in gh_usernames]
+        )
 
+        results = {}
+        for gh_username in gh_usernames:
+            external_id = get_external_id(gh_username)
+            commit_author = known_authors.get(external_id)
+            author_email = None
+            if commit_author is not None and not is_anonymous_email(commit_author.email):
+                author_email = commit_author.email
+            else:
+                author_email = self._find_user_email(client, organization, gh_username, gh_users)
+                if author_email is not None and commit_author is not None:
+                    try:
+                        with transaction.atomic():
+                            commit_author.update(
+                                email=author_email,
+                                external_id=external_id,
+                            )
+                    except IntegrityError:
+                        pass
+            results[gh_username] = (author_email, commit_author)
+        return results
+
+    def _parse_commits(self, event):
+        """
+        Extracts everything we need from the commits of a push which doesn't
+        depend on the organization, so that it's only done once per push.
+        """
+        commit_list = []
         for commit in event['commits']:
             if not commit['distinct']:
                 continue
@@ -130,129 +239,62 @@ class PushEventWebhook(Webhook):
                 author_email = u'{}@localhost'.format(
                     author_email[:65],
                 )
-            # try to figure out who anonymous emails are
-            elif is_anonymous_email(author_email):
-                gh_username = commit['author'].get('username')
+
+            file_changes = [(fname, 'A') for fname in commit['added']]
+            file_changes.extend((fname, 'D') for fname in commit['removed'])
+            file_changes.extend((fname, 'M') for fname in commit['modified'])
+
+            commit_list.append({
+                'key': commit['id'],
+                'message': commit['message'],
+                'author_email': author_email,
+                'author_name': commit['author']['name'][:128],
                 # bot users don't have usernames
-                if gh_username:
-                    external_id = get_external_id(gh_username)
-                    if gh_username in gh_username_cache:
-                        author_email = gh_username_cache[gh_username] or author_email
-                    else:
-                        try:
-                            commit_author = CommitAuthor.objects.get(
-                                external_id=external_id,
-                                organization_id=organization.id,
-                            )
-                        except CommitAuthor.DoesNotExist:
-                            commit_author = None
-
-                        if commit_author is not None and not is_anonymous_email(
-                            commit_author.email
-                        ):
-                            author_email = commit_author.email
-                            gh_username_cache[gh_username] = author_email
-                        else:
-                            try:
-                                gh_user = client.request_no_auth('GET', '/users/%s' % gh_username)
-                            except ApiError as exc:
-                                logger.exception(six.text_type(exc))
-                            else:
-                                # even if we can't find a user, set to none so we
-                                # don't re-query
-                                gh_username_cache[gh_username] = None
-                                try:
-                                    user = User.objects.filter(
-                                        social_auth__provider='github',
-                                        social_auth__uid=gh_user['id'],
-                                        org_memberships=organization,
-                                    )[0]
-                                except IndexError:
-                                    pass
-                                else:
-                                    author_email = user.email
-                                    gh_username_cache[gh_username] = author_email
-                                    if commit_author is not None:
-                                        try:
-                                            with transaction.atomic():
-                                                commit_author.update(
-                                                    email=author_email,
-                                                    external_id=external_id,
-                                                )
-                                        except IntegrityError:
-                                            pass
-
-                        if commit_author is not None:
-                            authors[author_email] = commit_author
+                'author_username': commit['author'].get('username'),
+                'date_added': dateutil.parser.parse(
+                    commit['timestamp'],
+                ).astimezone(timezone.utc),
+                'file_changes': file_changes,
+            })
+        return commit_list
+
+    def _handle(self, organization, repo, commit_list, gh_users):
+        resolver = CommitAuthorResolver(organization.id)
+        anonymous = self._resolve_anonymous_emails(organization, resolver, set(
+            c['author_username'] for c in commit_list
+            if c['author_username'] and is_anonymous_email(c['author_email'])
+        ), gh_users)
+
+        author_emails = []
+        for commit in commit_list:
+            author_email = commit['author_email']
+            gh_username = commit['author_username']
+            if gh_username in anonymous and is_anonymous_email(author_email):
+                resolved_email, commit_author = anonymous[gh_username]
+                author_email = resolved_email or author_email
+                if commit_author is not None:
+                    resolver.set(author_email, commit_author)
 
             # TODO(dcramer): we need to deal with bad values here, but since
             # its optional, lets just throw it out for now
             if len(author_email) > 75:
-                author = None
-            elif author_email not in authors:
-                authors[author_email] = author = CommitAuthor.objects.get_or_create(
-                    organization_id=organization.id,
-                    email=author_email,
-                    defaults={
-                        'name': commit['author']['name'][:128],
-                    }
-                )[0]
-
-                update_kwargs = {}
-
-                if author.name != commit['author']['name'][:128]:
-                    update_kwargs['name'] = commit['author']['name'][:128]
-
-                gh_username = commit['author'].get('username')
-                if gh_username:
+                author_email = None
+            else:
+                if gh_username and not is_anonymous_email(author_email):
                     external_id = get_external_id(gh_username)
-                    if author.external_id != external_id and not is_anonymous_email(author.email):
-                        update_kwargs['external_id'] = external_id
+                else:
+                    external_id = None
+                resolver.add(author_email, commit['author_name'], external_id)
+            author_emails.append(author_email)
 
-                if update_kwargs:
-                    try:
-                        with transaction.atomic():
-                            author.update(**update_kwargs)
-                    except IntegrityError:
-                        pass
-            else:
-                author = authors[author_email]
+        resolver.resolve()
 
-            try:
-                with transaction.atomic():
-                    c = Commit.objects.create(
-                        repository_id=repo.id,
-                        organization_id=organization.id,
-                        key=commit['id'],
-                        message=commit['message'],
-                        author=author,
-                        date_added=dateutil.parser.parse(
-                            commit['timestamp'],
-                        ).astimezone(timezone.utc),
-                    )
-                    for fname in commit['added']:
-                        CommitFileChange.objects.create(
-                            organization_id=organization.id,
-                            commit=c,
-                            filename=fname,
-                            type='A',
-                        )
-                    for fname in commit['removed']:
-                        CommitFileChange.objects.create(
-                            organization_id=organization.id,
-                            commit=c,
-                            filename=fname,
-                            type='D',
-                        )
-                    for fname in commit['modified']:
-                        CommitFileChange.objects.create(
-                            organization_id=organization.id,
-                            commit=c,
-                            filename=fname,
-                            type='M',
-                        )
-            except IntegrityError:
-                pass
+        bulk_create_commits(organization.id, repo.id, [
+            dict(
+                commit,
+                author=resolver.get(author_email) if author_email else None,
+            ) for commit, author_email in zip(commit_list, author_emails)
+        ])
 
     # https://developer.github.com/v3/activity/events/types/#pushevent
     def __call__(self, event, organization=None):
@@ -269,8 +311,30 @@ class PushEventWebhook(Webhook):
         else:
             organizations = [organization]
 
+        repos = {
+            r.organization_id: r for r in Repository.objects.filter(
+                organization_id__in=[o.id for o in organizations],
+                provider='github_apps' if is_apps else 'github',
+                external_id=six.text_type(event['repository']['id']),
+            )
+        }
+        if not repos:
+            raise Http404()
+
+        commit_list = self._parse_commits(event)
+        gh_users = {}
         for org in organizations:
-            self._handle(event, org, is_apps)
+            repo = repos.get(org.id)
+            if repo is None:
+                continue
+
+            # We need to track GitHub's "full_name" which is the repository slug.
+            # This is needed to access the API since `external_id` isn't sufficient.
+            if repo.config.get('name') != event['repository']['full_name']:
+                repo.config['name'] = event['repository']['full_name']
+                repo.save()
+
+            self._handle(org, repo, commit_list, gh_users)
 
 
 class PullRequestEventWebhook(Webhook):
@@ -358,6 +422,8 @@ class GithubWebhookBase(View):
         'pull_request': PullRequestEventWebhook,
     }
 
+    is_integration = False
+
     # https://developer.github.com/webhooks/
     def get_handler(self, event_type):
         return self._handlers.get(event_type)
@@ -443,8 +509,13 @@ class GithubWebhookBase(View):
             )
             return HttpResponse(status=400)
 
-        handler()(event, organization=organization)
-        return HttpResponse(status=204)
+        process_webhook_event.delay(
+            event_type=request.META['HTTP_X_GITHUB_EVENT'],
+            event=event,
+            organization_id=organization.id if organization is not None else None,
+            integration=self.is_integration,
+        )
+        return HttpResponse(status=202)
 
 
 # non-integration version
@@ -483,6 +554,8 @@ class GithubIntegrationsWebhookEndpoint(GithubWebhookBase):
         'installation_repositories': InstallationRepositoryEventWebhook,
     }
 
+    is_integration = True
+
     @method_decorator(csrf_exempt)
     def dispatch(self, request, *args, **kwargs):
         if request.method != 'POST':
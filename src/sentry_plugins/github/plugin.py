@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import logging
 import six
 
+from itertools import islice
 from rest_framework.response import Response
 from uuid import uuid4
 
@@ -371,27 +372,27 @@ class GitHubRepositoryProvider(GitHubMixin, providers.RepositoryProvider):
             } for c in commit_list
         ]
 
+    def _compare_commits(self, client, repo, start_sha, end_sha):
+        client.set_background()
+        # use config name because that is kept in sync via webhooks
+        name = repo.config['name']
+        # the client fetches pages as they're needed, so any api errors come
+        # up while we're formatting
+        try:
+            if start_sha is None:
+                return self._format_commits(
+                    repo, islice(client.get_last_commits(name, end_sha), 10),
+                )
+            return self._format_commits(repo, client.compare_commits(name, start_sha, end_sha))
+        except Exception as e:
+            self.raise_error(e)
+
     def compare_commits(self, repo, start_sha, end_sha, actor=None):
         if actor is None:
             raise NotImplementedError('Cannot fetch commits anonymously')
         client = self.get_client(actor)
 
-        # use config name because that is kept in sync via webhooks
-        name = repo.config['name']
-        if start_sha is None:
-            try:
-                res = client.get_last_commits(name, end_sha)
-            except Exception as e:
-                self.raise_error(e)
-            else:
-                return self._format_commits(repo, res[:10])
-        else:
-            try:
-                res = client.compare_commits(name, start_sha, end_sha)
-            except Exception as e:
-                self.raise_error(e)
-            else:
-                return self._format_commits(repo, res['commits'])
+        return self._compare_commits(client, repo, start_sha, end_sha)
 
         def get_pr_commits(self, repo, number, actor=None):
             # (not currently used by sentry)
@@ -495,22 +496,7 @@ class GitHubAppsRepositoryProvider(GitHubRepositoryProvider):
             Integration.objects.get(id=integration_id),
         )
 
-        # use config name because that is kept in sync via webhooks
-        name = repo.config['name']
-        if start_sha is None:
-            try:
-                res = client.get_last_commits(name, end_sha)
-            except Exception as e:
-                self.raise_error(e)
-            else:
-                return self._format_commits(repo, res[:10])
-        else:
-            try:
-                res = client.compare_commits(name, start_sha, end_sha)
-            except Exception as e:
-                self.raise_error(e)
-            else:
-                return self._format_commits(repo, res['commits'])
+        return self._compare_commits(client, repo, start_sha, end_sha)
 
     def get_installations(self, actor):
         if not actor.is_authenticated():
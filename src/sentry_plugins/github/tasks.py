@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+import logging
+
+from django.http import Http404
+from sentry.models import Integration, Organization
+from sentry.tasks.base import instrumented_task, retry
+
+logger = logging.getLogger('sentry.webhooks')
+
+
+@instrumented_task(
+    name='sentry_plugins.github.tasks.process_webhook_event',
+    queue='commits',
+    default_retry_delay=60 * 5,
+    max_retries=5,
+)
+@retry(exclude=(Http404, Integration.DoesNotExist, Organization.DoesNotExist))
+def process_webhook_event(event_type, event, organization_id=None, integration=False, **kwargs):
+    """
+    Runs the handler of a webhook event which the endpoint has already
+    verified. Handlers skip commits which already exist, so a delivery can
+    safely be processed more than once.
+    """
+    from sentry_plugins.github.endpoints.webhook import (
+        GithubIntegrationsWebhookEndpoint, GithubWebhookEndpoint
+    )
+
+    if integration:
+        endpoint = GithubIntegrationsWebhookEndpoint()
+    else:
+        endpoint = GithubWebhookEndpoint()
+
+    handler = endpoint.get_handler(event_type)
+    if handler is None:
+        return
+
+    if organization_id is not None:
+        organization = Organization.objects.get_from_cache(id=organization_id)
+    else:
+        organization = None
+
+    try:
+        handler()(event, organization=organization)
+    except Http404:
+        logger.info(
+            'github.webhook.missing-repository',
+            extra={
+                'organization_id': organization_id,
+                'event_type': event_type,
+            }
+        )
@@ -8,6 +8,10 @@ from sentry_plugins.exceptions import ApiError
 
 
 class GitLabClient(object):
+    # in seconds
+    connect_timeout = 5
+    read_timeout = 30
+
     def __init__(self, url, token):
         self.url = url
         self.token = token
@@ -24,6 +28,7 @@ class GitLabClient(object):
                 json=data,
                 params=params,
                 allow_redirects=False,
+                timeout=(self.connect_timeout, self.read_timeout),
             )
             resp.raise_for_status()
         except HTTPError as e:
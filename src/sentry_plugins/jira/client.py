@@ -33,18 +33,29 @@ class JiraClient(ApiClient):
     COMMENT_URL = '/rest/api/2/issue/%s/comment'
     HTTP_TIMEOUT = 5
 
+    read_timeout = HTTP_TIMEOUT
+
+    # the metadata issue forms are built from, issues and searches change
+    # too often to be worth caching
+    conditional_requests = True
+    conditional_paths = re.compile(
+        r'^/rest/api/2/(project|project/[^/]+/versions|priority|issue/createmeta)/?$'
+    )
+
     def __init__(self, instance_uri, username, password):
         self.base_url = instance_uri.rstrip('/')
         self.username = username
         self.password = password
         super(JiraClient, self).__init__(verify_ssl=False)
 
-    def request(self, method, path, data=None, params=None):
+    def request(self, method, path, data=None, params=None, ordered_json=None):
         if self.username and self.password:
             auth = self.username.encode('utf8'), self.password.encode('utf8')
         else:
             auth = None
-        return self._request(method, path, data=data, params=params, auth=auth)
+        return self._request(
+            method, path, data=data, params=params, auth=auth, ordered_json=ordered_json,
+        )
 
     def get_projects_list(self):
         return self.get_cached(self.PROJECT_URL)
@@ -53,6 +64,8 @@ class JiraClient(ApiClient):
         return self.get(
             self.META_URL,
             params={'projectKeys': project, 'expand': 'projects.issuetypes.fields'},
+            # issue forms list the fields in the order Jira returns them
+            ordered_json=True,
         )
 
     def get_create_meta_for_project(self, project):
@@ -14,6 +14,10 @@ INTEGRATION_API_URL = \
 class PagerDutyClient(object):
     client = 'sentry'
 
+    # in seconds
+    connect_timeout = 5
+    read_timeout = 10
+
     def __init__(self, service_key=None):
         self.service_key = service_key
 
@@ -29,6 +33,7 @@ class PagerDutyClient(object):
                 url=INTEGRATION_API_URL,
                 json=payload,
                 allow_redirects=False,
+                timeout=(self.connect_timeout, self.read_timeout),
             )
             resp.raise_for_status()
         except HTTPError as e:
@@ -9,6 +9,10 @@ from sentry_plugins.exceptions import ApiError
 class PushoverClient(object):
     base_url = 'https://api.pushover.net/1'
 
+    # in seconds
+    connect_timeout = 5
+    read_timeout = 10
+
     def __init__(self, userkey=None, apikey=None):
         self.userkey = userkey
         self.apikey = apikey
@@ -29,6 +33,7 @@ class PushoverClient(object):
                 url='{}{}'.format(self.base_url, path),
                 data=payload,
                 allow_redirects=False,
+                timeout=(self.connect_timeout, self.read_timeout),
             )
             resp.raise_for_status()
         except HTTPError as e:
@@ -1,10 +1,21 @@
 from __future__ import absolute_import
 
-from sentry import http
+import logging
+
+from cached_property import cached_property
+from requests.exceptions import ConnectionError, HTTPError
 from sentry.plugins.bases.data_forwarding import DataForwardingPlugin
 
 from sentry_plugins.base import CorePluginMixin
-from sentry_plugins.utils import get_secret_field_config
+from sentry_plugins.buffer import BatchBuffer
+from sentry_plugins.client import session_pool
+from sentry_plugins.utils import EncodedPayload, EventSummary, get_secret_field_config
+
+logger = logging.getLogger('sentry.plugins.segment')
+
+# https://segment.com/docs/sources/server/http/#max-request-size
+MAX_MESSAGE_SIZE = 32 * 1024
+MAX_BATCH_SIZE = 500 * 1024
 
 
 class SegmentPlugin(CorePluginMixin, DataForwardingPlugin):
@@ -14,6 +25,15 @@ class SegmentPlugin(CorePluginMixin, DataForwardingPlugin):
     conf_key = 'segment'
 
     endpoint = 'https://api.segment.io/v1/track'
+    batch_endpoint = 'https://api.segment.io/v1/batch'
+
+    batch_max_count = 1000
+    batch_max_delay = 5.0
+    batch_max_retries = 3
+
+    # in seconds
+    connect_timeout = 5
+    read_timeout = 10
 
     def get_config(self, project, **kwargs):
         return [
@@ -23,41 +43,48 @@ class SegmentPlugin(CorePluginMixin, DataForwardingPlugin):
                 secret=self.get_option('write_key', project),
                 help_text='Your Segment write key',
             ),
+            {
+                'name': 'batch',
+                'label': 'Batch Events',
+                'type': 'bool',
+                'default': False,
+                'required': False,
+                'help': 'Buffer events and send them to Segment in batches '
+                        'rather than with one request per event.',
+            },
         ]
 
     def get_rate_limit(self):
         # number of requests, number of seconds (window)
         return (50, 1)
 
-    def get_event_props(self, event):
+    def get_base_props(self, summary):
         props = {
-            'eventId': event.event_id,
-            'transaction': event.get_tag('transaction') or '',
-            'release': event.get_tag('sentry:release') or '',
-            'environment': event.get_tag('environment') or '',
+            'eventId': summary.event.event_id,
+            'transaction': summary.transaction,
+            'release': summary.release,
+            'environment': summary.environment,
         }
-        if 'sentry.interfaces.Http' in event.interfaces:
-            http = event.interfaces['sentry.interfaces.Http']
-            headers = http.headers
-            if not isinstance(headers, dict):
-                headers = dict(headers or ())
+        if summary.exception is not None:
+            props['exceptionType'] = summary.exception.type
+        return props
 
+    def get_event_props(self, event):
+        summary = EventSummary.for_event(event)
+        props = self.get_base_props(summary)
+        if summary.http is not None:
             props.update(
                 {
-                    'requestUrl': http.url,
-                    'requestMethod': http.method,
-                    'requestReferer': headers.get('Referer', ''),
+                    'requestUrl': summary.http['url'],
+                    'requestMethod': summary.http['method'],
+                    'requestReferer': summary.http['referer'],
                 }
             )
-        if 'sentry.interfaces.Exception' in event.interfaces:
-            exc = event.interfaces['sentry.interfaces.Exception'].values[0]
-            props.update({
-                'exceptionType': exc.type,
-            })
         return props
 
     # https://segment.com/docs/spec/track/
     def get_event_payload(self, event):
+        summary = EventSummary.for_event(event)
         context = {
             'library': {
                 'name': 'sentry',
@@ -65,50 +92,31 @@ class SegmentPlugin(CorePluginMixin, DataForwardingPlugin):
             },
         }
 
-        props = {
-            'eventId': event.event_id,
-            'transaction': event.get_tag('transaction') or '',
-            'release': event.get_tag('sentry:release') or '',
-            'environment': event.get_tag('environment') or '',
-        }
-
-        if 'sentry.interfaces.User' in event.interfaces:
-            user = event.interfaces['sentry.interfaces.User']
-            if user.ip_address:
-                context['ip'] = user.ip_address
-            user_id = user.id
+        if summary.user is not None:
+            if summary.user.ip_address:
+                context['ip'] = summary.user.ip_address
+            user_id = summary.user.id
         else:
             user_id = None
 
-        if 'sentry.interfaces.Http' in event.interfaces:
-            http = event.interfaces['sentry.interfaces.Http']
-            headers = http.headers
-            if not isinstance(headers, dict):
-                headers = dict(headers or ())
-
+        if summary.http is not None:
             context.update(
                 {
-                    'userAgent': headers.get('User-Agent', ''),
+                    'userAgent': summary.http['user_agent'],
                     'page': {
-                        'url': http.url,
-                        'method': http.method,
-                        'search': http.query_string or '',
-                        'referrer': headers.get('Referer', ''),
+                        'url': summary.http['url'],
+                        'method': summary.http['method'],
+                        'search': summary.http['query_string'],
+                        'referrer': summary.http['referer'],
                     },
                 }
             )
 
-        if 'sentry.interfaces.Exception' in event.interfaces:
-            exc = event.interfaces['sentry.interfaces.Exception'].values[0]
-            props.update({
-                'exceptionType': exc.type,
-            })
-
         return {
             'context': context,
             'userId': user_id,
             'event': 'Error Captured',
-            'properties': props,
+            'properties': self.get_base_props(summary),
             'integration': {
                 'name': 'sentry',
                 'version': self.version,
@@ -140,5 +148,52 @@ class SegmentPlugin(CorePluginMixin, DataForwardingPlugin):
         if not write_key:
             return
 
-        session = http.build_session()
-        session.post(self.endpoint, json=payload, auth=(write_key, ''))
+        if self.get_option('batch', event.project):
+            message = EncodedPayload(dict(payload, type='track'))
+            if message.size > MAX_MESSAGE_SIZE:
+                logger.info('segment.message-too-large', extra={
+                    'event_id': event.event_id,
+                    'size': message.size,
+                })
+                return
+            self.buffer.append(write_key, message.data, size=message.size)
+            return
+
+        message = EncodedPayload(payload)
+        session = session_pool.get(self.endpoint)
+        session.post(
+            self.endpoint,
+            data=message.data,
+            headers={'Content-Type': message.content_type},
+            auth=(write_key, ''),
+            timeout=(self.connect_timeout, self.read_timeout),
+        )
+
+    @cached_property
+    def buffer(self):
+        return BatchBuffer(
+            self.send_batch,
+            max_count=self.batch_max_count,
+            # leave room for the envelope around the messages
+            max_bytes=MAX_BATCH_SIZE - 1024,
+            max_delay=self.batch_max_delay,
+            should_retry=self.should_retry_batch,
+            max_retries=self.batch_max_retries,
+        )
+
+    # https://segment.com/docs/sources/server/http/#batch
+    def send_batch(self, write_key, messages):
+        session = session_pool.get(self.batch_endpoint)
+        session.post(
+            self.batch_endpoint,
+            data=b'{"batch":[' + b','.join(messages) + b']}',
+            headers={'Content-Type': EncodedPayload.content_type},
+            auth=(write_key, ''),
+            timeout=(self.connect_timeout, self.read_timeout),
+        ).raise_for_status()
+
+    def should_retry_batch(self, exc):
+        if isinstance(exc, ConnectionError):
+            return True
+        return isinstance(exc, HTTPError) and exc.response is not None \
+            and exc.response.status_code >= 500
@@ -1,9 +1,17 @@
 from __future__ import absolute_import
 
 import json
+import os
 import requests
+import threading
 
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 from sentry.http import safe_urlopen
+from sentry.utils.cache import cache
+from sentry.utils.hashlib import md5_text
+
+from sentry_plugins.utils import CircuitBreaker, Deadline, DeadlineExceeded, LocalCache
 
 from .utils import (get_basic_auth, remove_trailing_slashes, add_query_params)
 
@@ -19,6 +27,49 @@ SESSION_URL_PATH = '/#/sessions/'
 
 MILLISECONDS_BEFORE_EVENT = 5000
 
+# the access token of a session can be reused for as long as it's valid, and
+# a session never changes its start
+ACCESS_TOKEN_TTL = 60 * 60
+SESSION_START_TTL = 24 * 60 * 60
+
+# failed lookups are remembered for a while so we don't repeat them for
+# every event of the session
+NEGATIVE_TTL = 5 * 60
+
+# an in-process layer in front of the shared cache for the busiest sessions.
+# Its entries are kept briefly, as we can't tell how much longer the shared
+# entry they were read from has left
+local_cache = LocalCache(max_size=10000)
+LOCAL_CACHE_TTL = 60
+
+# stops us from calling the API of a website once it keeps failing
+circuit_breaker = CircuitBreaker(failure_threshold=5, reset_timeout=60)
+
+# how long building a session URL may take in total, in seconds
+LOOKUP_TIMEOUT = 3
+
+# each request is given at most this long to connect and to respond,
+# whichever is less of what's left of the lookup
+LOOKUP_CONNECT_TIMEOUT = 1
+LOOKUP_READ_TIMEOUT = 3
+
+LOOKUP_POOL_SIZE = 8
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_lookup_pool():
+    # the pool is created lazily, and again in forked workers, as threads
+    # don't survive a fork
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPool(LOOKUP_POOL_SIZE)
+            _pool_pid = os.getpid()
+        return _pool
+
 
 class SessionStackClient(object):
     def __init__(self, account_email, api_token, website_id, **kwargs):
@@ -30,6 +81,10 @@ class SessionStackClient(object):
         player_url = kwargs.get('player_url') or PLAYER_URL
         self.player_url = remove_trailing_slashes(player_url)
 
+        self.timeout = kwargs.get('timeout') or LOOKUP_TIMEOUT
+
+        self.breaker_key = u'{}:{}'.format(self.api_url, self.website_id)
+
         self.request_headers = {
             'Authorization': get_basic_auth(account_email, api_token),
             'Content-Type': 'application/json'
@@ -40,7 +95,7 @@ class SessionStackClient(object):
 
         try:
             response = self._make_request(website_endpoint, 'GET')
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError, LookupTimeoutError):
             raise InvalidApiUrlError
 
         if response.status_code == requests.codes.UNAUTHORIZED:
@@ -52,35 +107,95 @@ class SessionStackClient(object):
 
         response.raise_for_status()
 
-    def get_session_url(self, session_id, event_timestamp):
+    def is_available(self):
+        return not circuit_breaker.is_open(self.breaker_key)
 
+    def get_session_url(self, session_id, event_timestamp):
+        """
+        Builds the player URL for a session, looking up its access token and
+        start concurrently. Raises ``LookupTimeoutError`` if that takes
+        longer than ``timeout`` seconds.
+        """
         player_url = self.player_url + SESSION_URL_PATH + session_id
         query_params = {}
 
-        access_token = self._get_access_token(session_id)
+        # the deadline is passed on to the requests themselves, so lookups
+        # which time out don't keep holding on to a thread of the pool
+        deadline = Deadline(self.timeout)
+        pool = get_lookup_pool()
+        access_token_result = pool.apply_async(self._get_access_token, (session_id, deadline))
+        if event_timestamp is not None:
+            start_timestamp_result = pool.apply_async(
+                self._get_session_start_timestamp, (session_id, deadline),
+            )
+        else:
+            start_timestamp_result = None
+
+        try:
+            access_token = access_token_result.get(deadline.remaining())
+            if start_timestamp_result is not None:
+                start_timestamp = start_timestamp_result.get(deadline.remaining())
+            else:
+                start_timestamp = None
+        except TimeoutError:
+            # the request which is taking too long records the failure once
+            # it times out itself
+            raise LookupTimeoutError
+
         if access_token is not None:
             query_params['access_token'] = access_token
 
-        if event_timestamp is not None:
-            start_timestamp = self._get_session_start_timestamp(session_id)
-            if start_timestamp is not None:
-                pause_at = event_timestamp - start_timestamp
-                play_from = pause_at - MILLISECONDS_BEFORE_EVENT
+        if start_timestamp is not None:
+            pause_at = event_timestamp - start_timestamp
+            play_from = pause_at - MILLISECONDS_BEFORE_EVENT
 
-                query_params['pause_at'] = pause_at
-                query_params['play_from'] = play_from
+            query_params['pause_at'] = pause_at
+            query_params['play_from'] = play_from
 
         return add_query_params(player_url, query_params)
 
-    def _get_access_token(self, session_id):
-        access_token = self._create_access_token(session_id)
+    def _get_cached(self, name, session_id, ttl, func, deadline=None):
+        # the credentials are part of the key, as projects sharing a website
+        # may not share access to it
+        key = 'sessionstack:{}:{}'.format(
+            name,
+            md5_text(u'{}:{}:{}:{}'.format(
+                self.api_url,
+                self.website_id,
+                self.request_headers['Authorization'],
+                session_id,
+            )).hexdigest(),
+        )
+        # failed lookups are cached as False
+        value = local_cache.get(key)
+        if value is None:
+            value = cache.get(key)
+            if value is None:
+                value = func(session_id, deadline)
+                if value is None:
+                    value = False
+                    ttl = NEGATIVE_TTL
+                cache.set(key, value, ttl)
+            local_cache.set(key, value, min(ttl, LOCAL_CACHE_TTL))
+
+        if value is False:
+            return None
+        return value
+
+    def _get_access_token(self, session_id, deadline=None):
+        return self._get_cached(
+            'access-token', session_id, ACCESS_TOKEN_TTL, self._fetch_access_token, deadline,
+        )
+
+    def _fetch_access_token(self, session_id, deadline=None):
+        access_token = self._create_access_token(session_id, deadline)
         if not access_token:
-            access_token = self._get_existing_access_token(session_id)
+            access_token = self._get_existing_access_token(session_id, deadline)
 
         return access_token
 
-    def _get_existing_access_token(self, session_id):
-        response = self._make_access_tokens_request(session_id, 'GET')
+    def _get_existing_access_token(self, session_id, deadline=None):
+        response = self._make_access_tokens_request(session_id, 'GET', deadline=deadline)
 
         if response.status_code != requests.codes.OK:
             return None
@@ -93,9 +208,12 @@ class SessionStackClient(object):
 
         return None
 
-    def _create_access_token(self, session_id):
+    def _create_access_token(self, session_id, deadline=None):
         response = self._make_access_tokens_request(
-            session_id=session_id, method='POST', body={'name': ACCESS_TOKEN_NAME}
+            session_id=session_id,
+            method='POST',
+            body={'name': ACCESS_TOKEN_NAME},
+            deadline=deadline,
         )
 
         if response.status_code != requests.codes.OK:
@@ -110,23 +228,57 @@ class SessionStackClient(object):
     def _get_access_tokens_endpoint(self, session_id):
         return ACCESS_TOKENS_ENDPOINT.format(self.website_id, session_id)
 
-    def _get_session_start_timestamp(self, session_id):
+    def _get_session_start_timestamp(self, session_id, deadline=None):
+        return self._get_cached(
+            'session-start', session_id, SESSION_START_TTL,
+            self._fetch_session_start_timestamp, deadline,
+        )
+
+    def _fetch_session_start_timestamp(self, session_id, deadline=None):
         endpoint = SESSION_ENDPOINT.format(self.website_id, session_id)
-        response = self._make_request(endpoint, 'GET')
+        response = self._make_request(endpoint, 'GET', deadline=deadline)
 
         if response.status_code == requests.codes.OK:
             return json.loads(response.content).get('client_start')
 
-    def _make_request(self, endpoint, method, **kwargs):
+    def _make_request(self, endpoint, method, deadline=None, **kwargs):
         url = self.api_url + endpoint
 
-        request_kwargs = {'method': method, 'headers': self.request_headers}
+        if deadline is None:
+            timeout = (LOOKUP_CONNECT_TIMEOUT, LOOKUP_READ_TIMEOUT)
+        else:
+            try:
+                timeout = deadline.get_timeout(LOOKUP_CONNECT_TIMEOUT, LOOKUP_READ_TIMEOUT)
+            except DeadlineExceeded:
+                raise LookupTimeoutError
+
+        request_kwargs = {
+            'method': method,
+            'headers': self.request_headers,
+            'timeout': timeout,
+        }
 
         body = kwargs.get('body')
         if body:
             request_kwargs['json'] = body
 
-        return safe_urlopen(url, **request_kwargs)
+        try:
+            response = safe_urlopen(url, **request_kwargs)
+        except requests.exceptions.Timeout:
+            circuit_breaker.record_failure(self.breaker_key)
+            raise LookupTimeoutError
+        except Exception:
+            circuit_breaker.record_failure(self.breaker_key)
+            raise
+
+        if response.status_code >= 500 or response.status_code in (
+            requests.codes.UNAUTHORIZED, requests.codes.FORBIDDEN
+        ):
+            circuit_breaker.record_failure(self.breaker_key)
+        else:
+            circuit_breaker.record_success(self.breaker_key)
+
+        return response
 
 
 class UnauthorizedError(Exception):
@@ -139,3 +291,7 @@ class InvalidWebsiteIdError(Exception):
 
 class InvalidApiUrlError(Exception):
     pass
+
+
+class LookupTimeoutError(Exception):
+    pass
@@ -11,7 +11,8 @@ from sentry.exceptions import PluginError
 from sentry_plugins.base import CorePluginMixin
 
 from .client import (
-    SessionStackClient, UnauthorizedError, InvalidWebsiteIdError, InvalidApiUrlError
+    SessionStackClient, UnauthorizedError, InvalidWebsiteIdError, InvalidApiUrlError,
+    LookupTimeoutError
 )
 
 UNAUTHORIZED_ERROR = (
@@ -182,11 +183,21 @@ class SessionStackPlugin(CorePluginMixin, Plugin2):
                 player_url=self.get_option('player_url', project)
             )
 
-            session_url = sessionstack_client.get_session_url(
-                session_id=session_id, event_timestamp=context.get('timestamp')
-            )
-
-            context['session_url'] = session_url
+            # the API has been failing, so skip enrichment for a while
+            if not sessionstack_client.is_available():
+                return event
+
+            try:
+                session_url = sessionstack_client.get_session_url(
+                    session_id=session_id, event_timestamp=context.get('timestamp')
+                )
+            except LookupTimeoutError:
+                # don't hold up ingestion, the event is still useful without it
+                self.logger.warning('sessionstack.lookup-timeout', extra={
+                    'project_id': project.id,
+                })
+            else:
+                context['session_url'] = session_url
 
             contexts = event.get('contexts') or {}
             contexts['sessionstack'] = context
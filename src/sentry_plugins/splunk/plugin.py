@@ -15,14 +15,16 @@ For more details on the payload: http://dev.splunk.com/view/event-collector/SP-C
 
 from __future__ import absolute_import
 
-from sentry import http
+from cached_property import cached_property
 from sentry.app import ratelimiter
 from sentry.plugins.base import Plugin
 from sentry.plugins.base.configuration import react_plugin_config
 from sentry.utils.hashlib import md5_text
 
 from sentry_plugins.base import CorePluginMixin
-from sentry_plugins.utils import get_secret_field_config
+from sentry_plugins.buffer import BatchBuffer
+from sentry_plugins.client import session_pool
+from sentry_plugins.utils import EncodedPayload, EventSummary, get_secret_field_config
 
 
 class SplunkPlugin(CorePluginMixin, Plugin):
@@ -31,6 +33,15 @@ class SplunkPlugin(CorePluginMixin, Plugin):
     description = 'Send Sentry events into Splunk.'
     conf_key = 'splunk'
 
+    # limits for a single batched request to the collector
+    batch_max_count = 500
+    batch_max_bytes = 512 * 1024
+    batch_max_delay = 1.0
+
+    # in seconds
+    connect_timeout = 5
+    read_timeout = 10
+
     def configure(self, project, request):
         return react_plugin_config(self, project, request)
 
@@ -64,49 +75,51 @@ class SplunkPlugin(CorePluginMixin, Plugin):
             name='token',
             label='Token',
             secret=self.get_option('token', project),
-        )]
+        ), {
+            'name': 'batch',
+            'label': 'Batch Events',
+            'type': 'bool',
+            'default': False,
+            'required': False,
+            'help': 'Buffer events and send them to the collector in batches '
+                    'rather than with one request per event.',
+        }]
 
     def get_host_for_splunk(self, event):
-        host = event.get_tag('server_name')
+        summary = EventSummary.for_event(event)
+        host = summary.server_name
         if host:
             return host
 
-        user_interface = event.interfaces.get('sentry.interfaces.User')
-        if user_interface:
-            host = user_interface.ip_address
+        if summary.user is not None:
+            host = summary.user.ip_address
             if host:
                 return host
 
         return None
 
     def get_event_payload(self, event):
+        summary = EventSummary.for_event(event)
         props = {
             'event_id': event.event_id,
-            'transaction': event.get_tag('transaction') or '',
-            'release': event.get_tag('sentry:release') or '',
-            'environment': event.get_tag('environment') or '',
+            'transaction': summary.transaction,
+            'release': summary.release,
+            'environment': summary.environment,
         }
-        if 'sentry.interfaces.Http' in event.interfaces:
-            http = event.interfaces['sentry.interfaces.Http']
-            headers = http.headers
-            if not isinstance(headers, dict):
-                headers = dict(headers or ())
-
+        if summary.http is not None:
             props.update({
-                'request_url': http.url,
-                'request_method': http.method,
-                'request_referer': headers.get('Referer', ''),
+                'request_url': summary.http['url'],
+                'request_method': summary.http['method'],
+                'request_referer': summary.http['referer'],
             })
-        if 'sentry.interfaces.Exception' in event.interfaces:
-            exc = event.interfaces['sentry.interfaces.Exception'].values[0]
+        if summary.exception is not None:
             props.update({
-                'exception_type': exc.type,
-                'exception_value': exc.value,
+                'exception_type': summary.exception.type,
+                'exception_value': summary.exception.value,
             })
-        elif 'sentry.interfaces.Message' in event.interfaces:
-            msg = event.interfaces['sentry.interfaces.Message']
+        elif 'sentry.interfaces.Message' in summary.interfaces:
             props.update({
-                'message': msg.formatted or msg.message,
+                'message': summary.message,
             })
         return props
 
@@ -138,13 +151,33 @@ class SplunkPlugin(CorePluginMixin, Plugin):
         if host:
             payload['host'] = host
 
-        session = http.build_session()
+        message = EncodedPayload(payload)
+        if self.get_option('batch', event.project):
+            self.buffer.append((instance, token), message.data, size=message.size)
+        else:
+            self.send_events((instance, token), [message.data])
+
+    @cached_property
+    def buffer(self):
+        return BatchBuffer(
+            self.send_events,
+            max_count=self.batch_max_count,
+            max_bytes=self.batch_max_bytes,
+            max_delay=self.batch_max_delay,
+        )
+
+    def send_events(self, key, messages):
+        # the collector accepts any number of events concatenated together
+        instance, token = key
+        session = session_pool.get(instance, verify_ssl=False)
         session.post(
             instance,
-            json=payload,
+            data=b''.join(messages),
             # Splunk cloud instances certifcates dont play nicely
             verify=False,
             headers={
-                'Authorization': 'Splunk {}'.format(token)
+                'Authorization': 'Splunk {}'.format(token),
+                'Content-Type': EncodedPayload.content_type,
             },
+            timeout=(self.connect_timeout, self.read_timeout),
         ).raise_for_status()
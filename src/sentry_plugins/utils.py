@@ -1,5 +1,17 @@
 from __future__ import absolute_import
 
+import threading
+import time
+
+from cached_property import cached_property
+from collections import OrderedDict
+from django.utils.encoding import force_bytes
+from sentry.utils import json
+
+# the default connect and read timeouts of API clients, in seconds
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
 
 def get_secret_field_config(secret, help_text=None, include_prefix=False, **kwargs):
     has_saved_value = bool(secret)
@@ -14,3 +26,228 @@ def get_secret_field_config(secret, help_text=None, include_prefix=False, **kwar
         context['help'] = '%s%s' % ((saved_text if has_saved_value else ''), help_text)
     context.update(kwargs)
     return context
+
+
+class LocalCache(object):
+    """
+    A small thread-safe in-process cache. Entries expire after their own
+    ``ttl`` and the least recently used entry is evicted once the cache
+    holds ``max_size`` of them, or once the ``size`` given for each entry
+    adds up to more than ``max_bytes``.
+    """
+
+    def __init__(self, max_size=1000, max_bytes=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        value, expires_at, size = self._data.pop(key)
+        self._bytes -= size
+        return value, expires_at, size
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at, size = self._pop(key)
+            except KeyError:
+                return default
+            if expires_at < time.time():
+                return default
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            return value
+
+    def set(self, key, value, ttl, size=0):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            while self._data and (
+                len(self._data) >= self.max_size or
+                (self.max_bytes is not None and self._bytes + size > self.max_bytes)
+            ):
+                self._pop(next(iter(self._data)))
+            self._data[key] = (value, time.time() + ttl, size)
+            self._bytes += size
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+class CircuitBreaker(object):
+    """
+    Tracks consecutive failures per key. Once ``failure_threshold`` of them
+    have been recorded the breaker opens for ``reset_timeout`` seconds,
+    after which a single trial call is let through while the others are
+    still held back. A failure of that call reopens the breaker straight
+    away and a success closes it; if it records neither, another trial
+    is allowed once ``reset_timeout`` has passed again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = {}
+        self._opened_at = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, key):
+        with self._lock:
+            opened_at = self._opened_at.get(key)
+            if opened_at is None:
+                return False
+            now = time.time()
+            if now - opened_at < self.reset_timeout:
+                return True
+            # half-open: the caller becomes the trial, and restarting the
+            # timeout keeps everyone else out until it reports back
+            self._opened_at[key] = now
+            return False
+
+    def record_success(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+            self._opened_at.pop(key, None)
+
+    def record_failure(self, key):
+        with self._lock:
+            failures = self._failures[key] = self._failures.get(key, 0) + 1
+            if failures >= self.failure_threshold:
+                self._opened_at[key] = time.time()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """
+    The time left for an operation which makes several requests. Each
+    request gets its usual connect and read timeouts, cut down to whatever
+    remains of the budget.
+    """
+
+    def __init__(self, seconds):
+        self.expires_at = time.time() + seconds
+
+    def remaining(self):
+        return max(self.expires_at - time.time(), 0)
+
+    def get_timeout(self, connect_timeout, read_timeout):
+        # checked here rather than by callers, as a timeout of zero is
+        # rejected by requests
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded
+        return (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+
+class EncodedPayload(object):
+    """
+    A payload serialized to JSON exactly once, so that size checks,
+    compression and request bodies can all share the same bytes.
+    """
+    content_type = 'application/json'
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.data = force_bytes(json.dumps(payload))
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+class EventSummary(object):
+    """
+    The fields of an event which data forwarding plugins commonly send,
+    computed lazily and at most once per event.
+
+    Use ``EventSummary.for_event(event)`` so that every plugin processing
+    the same event shares one instance.
+    """
+
+    def __init__(self, event):
+        self.event = event
+
+    @classmethod
+    def for_event(cls, event):
+        summary = getattr(event, '_plugins_summary', None)
+        if summary is None:
+            summary = event._plugins_summary = cls(event)
+        return summary
+
+    @cached_property
+    def tags(self):
+        # ``Event.get_tag`` scans every tag on each call
+        return dict(self.event.get_tags())
+
+    @property
+    def transaction(self):
+        return self.tags.get('transaction') or ''
+
+    @property
+    def release(self):
+        return self.tags.get('sentry:release') or ''
+
+    @property
+    def environment(self):
+        return self.tags.get('environment') or ''
+
+    @property
+    def server_name(self):
+        return self.tags.get('server_name')
+
+    @cached_property
+    def interfaces(self):
+        return self.event.interfaces
+
+    @cached_property
+    def http(self):
+        http = self.interfaces.get('sentry.interfaces.Http')
+        if http is None:
+            return None
+
+        headers = http.headers
+        if not isinstance(headers, dict):
+            headers = dict(headers or ())
+
+        return {
+            'url': http.url,
+            'method': http.method,
+            'query_string': http.query_string or '',
+            'referer': headers.get('Referer', ''),
+            'user_agent': headers.get('User-Agent', ''),
+        }
+
+    @cached_property
+    def exception(self):
+        exc = self.interfaces.get('sentry.interfaces.Exception')
+        if exc is None:
+            return None
+        return exc.values[0]
+
+    @cached_property
+    def message(self):
+        msg = self.interfaces.get('sentry.interfaces.Message')
+        if msg is None:
+            return None
+        return msg.formatted or msg.message
+
+    @cached_property
+    def user(self):
+        return self.interfaces.get('sentry.interfaces.User')
@@ -10,6 +10,10 @@ class VictorOpsClient(object):
     monitoring_tool = 'sentry'
     routing_key = 'everyone'
 
+    # in seconds
+    connect_timeout = 5
+    read_timeout = 10
+
     def __init__(self, api_key, routing_key=None):
         self.api_key = api_key
 
@@ -29,6 +33,7 @@ class VictorOpsClient(object):
                 url=endpoint,
                 json=data,
                 allow_redirects=False,
+                timeout=(self.connect_timeout, self.read_timeout),
             )
             resp.raise_for_status()
         except HTTPError as e:
@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import re
+
 from sentry_plugins.client import AuthApiClient
 
 UNSET = object()
@@ -15,6 +17,11 @@ FIELD_MAP = {
 class VstsClient(AuthApiClient):
     api_version = '3.0'
 
+    # the projects listed in issue forms, work items and commits are
+    # rarely fetched twice
+    conditional_requests = True
+    conditional_paths = re.compile(r'^https://[^/]+/DefaultCollection/_apis/projects/?$')
+
     def request(self, method, path, data=None, params=None):
         headers = {
             'Accept': 'application/json; api-version={}'.format(self.api_version),
@@ -76,6 +76,7 @@ class VisualStudioRepositoryProvider(VisualStudioMixin, providers.RepositoryProv
             raise NotImplementedError('Cannot fetch commits anonymously')
 
         client = self.get_client(actor)
+        client.set_background()
         instance = repo.config['instance']
         if start_sha is None:
             try:
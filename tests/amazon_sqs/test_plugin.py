@@ -1,11 +1,17 @@
 from __future__ import absolute_import
 
+import base64
+import gzip
+import six
+
 from exam import fixture
 from mock import patch
 from sentry.testutils import PluginTestCase
 from sentry.utils import json
 
-from sentry_plugins.amazon_sqs.plugin import AmazonSQSPlugin
+from sentry_plugins.amazon_sqs.plugin import (
+    AmazonSQSPlugin, S3_POINTER_CLASS, clear_clients, get_client
+)
 
 
 class AmazonSQSPluginTest(PluginTestCase):
@@ -13,6 +19,21 @@ class AmazonSQSPluginTest(PluginTestCase):
     def plugin(self):
         return AmazonSQSPlugin()
 
+    def setUp(self):
+        super(AmazonSQSPluginTest, self).setUp()
+        clear_clients()
+        self.addCleanup(clear_clients)
+
+    def configure(self, **options):
+        self.plugin.set_option('access_key', 'access-key', self.project)
+        self.plugin.set_option('secret_key', 'secret-key', self.project)
+        self.plugin.set_option('region', 'us-east-1', self.project)
+        self.plugin.set_option(
+            'queue_url', 'https://sqs-us-east-1.amazonaws.com/12345678/myqueue', self.project
+        )
+        for key, value in options.items():
+            self.plugin.set_option(key, value, self.project)
+
     def test_conf_key(self):
         assert self.plugin.conf_key == 'amazon-sqs'
 
@@ -22,12 +43,7 @@ class AmazonSQSPluginTest(PluginTestCase):
 
     @patch('boto3.client')
     def test_simple_notification(self, mock_client):
-        self.plugin.set_option('access_key', 'access-key', self.project)
-        self.plugin.set_option('secret_key', 'secret-key', self.project)
-        self.plugin.set_option('region', 'us-east-1', self.project)
-        self.plugin.set_option(
-            'queue_url', 'https://sqs-us-east-1.amazonaws.com/12345678/myqueue', self.project
-        )
+        self.configure()
 
         group = self.create_group(message='Hello world', culprit='foo.bar')
         event = self.create_event(
@@ -63,3 +79,118 @@ class AmazonSQSPluginTest(PluginTestCase):
             QueueUrl='https://sqs-us-east-1.amazonaws.com/12345678/myqueue',
             MessageBody=json.dumps(self.plugin.get_event_payload(event)),
         )
+
+    @patch('boto3.client')
+    def test_client_cache(self, mock_client):
+        mock_client.side_effect = lambda **kwargs: object()
+
+        client = get_client('access-key', 'secret-key', 'us-east-1')
+        assert get_client('access-key', 'secret-key', 'us-east-1') is client
+        assert get_client('access-key', 'secret-key', 'us-west-1') is not client
+        # rotated credentials replace the cached client
+        assert get_client('access-key', 'new-secret-key', 'us-east-1') is not client
+        assert mock_client.call_count == 3
+
+    @patch('boto3.client')
+    def test_batched_notification(self, mock_client):
+        self.configure(batch=True)
+        send_message_batch = mock_client.return_value.send_message_batch
+        send_message_batch.side_effect = [
+            {
+                'Successful': [{'Id': '0'}],
+                'Failed': [{'Id': '1', 'SenderFault': False, 'Code': 'InternalError'}],
+            },
+            {
+                'Successful': [{'Id': '0'}],
+            },
+        ]
+        self.plugin.batch_retry_delay = 60
+
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        events = [
+            self.create_event(group=group, message='Hello world', tags={'level': 'warning'})
+            for _ in range(2)
+        ]
+
+        with self.options({'system.url-prefix': 'http://example.com'}):
+            for event in events:
+                self.plugin.post_process(event)
+
+        assert not send_message_batch.called
+        self.plugin.buffer.flush()
+        assert send_message_batch.call_count == 1
+        # the failed entry is resent after a backoff, or on the next flush
+        self.plugin.buffer.flush()
+
+        mock_client.assert_called_once_with(
+            service_name='sqs',
+            region_name='us-east-1',
+            aws_access_key_id='access-key',
+            aws_secret_access_key='secret-key',
+        )
+        messages = [json.dumps(self.plugin.get_event_payload(e)) for e in events]
+        assert send_message_batch.call_count == 2
+        assert send_message_batch.call_args_list[0][1]['Entries'] == [
+            {'Id': '0', 'MessageBody': messages[0]},
+            {'Id': '1', 'MessageBody': messages[1]},
+        ]
+        # only the failed entry is retried
+        assert send_message_batch.call_args_list[1][1]['Entries'] == [
+            {'Id': '0', 'MessageBody': messages[1]},
+        ]
+
+    def create_large_event(self):
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        return self.create_event(
+            group=group,
+            message='Hello world',
+            data={'extra': {'padding': 'a' * 300 * 1024}},
+            tags={'level': 'warning'},
+        )
+
+    @patch('boto3.client')
+    def test_oversized_event_dropped(self, mock_client):
+        self.configure()
+        event = self.create_large_event()
+
+        with self.options({'system.url-prefix': 'http://example.com'}):
+            self.plugin.post_process(event)
+
+        assert not mock_client.return_value.send_message.called
+
+    @patch('boto3.client')
+    def test_oversized_event_compressed(self, mock_client):
+        self.configure(compress=True)
+        event = self.create_large_event()
+
+        with self.options({'system.url-prefix': 'http://example.com'}):
+            self.plugin.post_process(event)
+
+        kwargs = mock_client.return_value.send_message.call_args[1]
+        assert kwargs['MessageAttributes']['ContentEncoding']['StringValue'] == 'gzip+base64'
+        body = gzip.GzipFile(
+            fileobj=six.BytesIO(base64.b64decode(kwargs['MessageBody'])),
+        ).read()
+        assert json.loads(body.decode('utf-8'))['event_id'] == event.event_id
+
+    @patch('boto3.client')
+    def test_oversized_event_offloaded(self, mock_client):
+        self.configure(s3_bucket='my-bucket')
+        event = self.create_large_event()
+
+        with self.options({'system.url-prefix': 'http://example.com'}):
+            self.plugin.post_process(event)
+
+        key = '{}/{}.json'.format(self.project.id, event.event_id)
+        upload_args = mock_client.return_value.upload_fileobj.call_args
+        assert upload_args[0][1:] == ('my-bucket', key)
+        data = upload_args[0][0].getvalue()
+        assert json.loads(data.decode('utf-8'))['event_id'] == event.event_id
+
+        kwargs = mock_client.return_value.send_message.call_args[1]
+        assert json.loads(kwargs['MessageBody']) == [S3_POINTER_CLASS, {
+            's3BucketName': 'my-bucket',
+            's3Key': key,
+        }]
+        assert kwargs['MessageAttributes']['ExtendedPayloadSize']['StringValue'] == \
+            six.text_type(len(data))
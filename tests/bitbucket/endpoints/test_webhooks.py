@@ -5,6 +5,7 @@ from datetime import datetime
 from django.utils import timezone
 from sentry.models import Commit, CommitAuthor, Repository
 from sentry.testutils import APITestCase, TestCase
+from sentry.utils import json
 
 from sentry_plugins.bitbucket.endpoints.webhook import parse_raw_user_email, parse_raw_user_name
 from sentry_plugins.bitbucket.testutils import PUSH_EVENT_EXAMPLE
@@ -84,15 +85,16 @@ class PushEventWebhookTest(APITestCase):
             name='maxbittker/newsdiffs',
         )
 
-        response = self.client.post(
-            path=url,
-            data=PUSH_EVENT_EXAMPLE,
-            content_type='application/json',
-            HTTP_X_EVENT_KEY='repo:push',
-            REMOTE_ADDR=BITBUCKET_IP,
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_EVENT_KEY='repo:push',
+                REMOTE_ADDR=BITBUCKET_IP,
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         commit_list = list(
             Commit.objects.filter(
@@ -132,15 +134,16 @@ class PushEventWebhookTest(APITestCase):
             name=u'bàxterthehacker',
         )
 
-        response = self.client.post(
-            path=url,
-            data=PUSH_EVENT_EXAMPLE,
-            content_type='application/json',
-            HTTP_X_EVENT_KEY='repo:push',
-            REMOTE_ADDR=BITBUCKET_IP,
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_EVENT_KEY='repo:push',
+                REMOTE_ADDR=BITBUCKET_IP,
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         commit_list = list(
             Commit.objects.filter(
@@ -159,3 +162,76 @@ class PushEventWebhookTest(APITestCase):
         assert commit.author.email == 'max@getsentry.com'
         assert commit.author.external_id is None
         assert commit.date_added == datetime(2017, 5, 24, 1, 5, 47, tzinfo=timezone.utc)
+
+    def test_existing_author(self):
+        project = self.project  # force creation
+
+        url = '/plugins/bitbucket/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        Repository.objects.create(
+            organization_id=project.organization.id,
+            external_id='{c78dfb25-7882-4550-97b1-4e0d38f32859}',
+            provider='bitbucket',
+            name='maxbittker/newsdiffs',
+        )
+
+        author = CommitAuthor.objects.create(
+            organization_id=project.organization_id,
+            email='max@getsentry.com',
+            name=u'Max',
+        )
+
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_EVENT_KEY='repo:push',
+                REMOTE_ADDR=BITBUCKET_IP,
+            )
+
+        assert response.status_code == 202
+
+        commit = Commit.objects.get(
+            organization_id=project.organization_id,
+            key='e0e377d186e4f0e937bdb487a23384fe002df649',
+        )
+        assert commit.author_id == author.id
+        # bitbucket never updated the names of existing authors
+        assert CommitAuthor.objects.get(id=author.id).name == u'Max'
+
+    def test_overlapping_changes(self):
+        project = self.project  # force creation
+
+        url = '/plugins/bitbucket/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        Repository.objects.create(
+            organization_id=project.organization.id,
+            external_id='{c78dfb25-7882-4550-97b1-4e0d38f32859}',
+            provider='bitbucket',
+            name='maxbittker/newsdiffs',
+        )
+
+        event = json.loads(PUSH_EVENT_EXAMPLE)
+        event['push']['changes'] *= 2
+
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=json.dumps(event),
+                content_type='application/json',
+                HTTP_X_EVENT_KEY='repo:push',
+                REMOTE_ADDR=BITBUCKET_IP,
+            )
+
+        assert response.status_code == 202
+
+        commit = Commit.objects.get(
+            organization_id=project.organization_id,
+        )
+        assert commit.key == 'e0e377d186e4f0e937bdb487a23384fe002df649'
+        assert commit.author.email == 'max@getsentry.com'
@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+
+import responses
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+
+from sentry_plugins.bitbucket.client import BitbucketClient
+
+COMMITS_URL = 'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/commits/c'
+
+
+def make_commit(sha):
+    return {
+        'hash': sha,
+        'author': {'raw': 'Max Bittker <max@getsentry.com>'},
+        'message': 'commit %s' % sha,
+    }
+
+
+class BitbucketClientTest(TestCase):
+    def add_diffstat(self, sha, values=()):
+        responses.add(
+            responses.GET,
+            'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/diffstat/%s' % sha,
+            body=json.dumps({'values': list(values)}),
+        )
+
+    @responses.activate
+    def test_compare_commits_paginated(self):
+        responses.add(
+            responses.GET,
+            COMMITS_URL,
+            body=json.dumps({
+                'values': [make_commit('c'), make_commit('b')],
+                'next': COMMITS_URL + '?page=2',
+            }),
+            match_querystring=True,
+        )
+        responses.add(
+            responses.GET,
+            COMMITS_URL + '?page=2',
+            body=json.dumps({
+                'values': [make_commit('a'), make_commit('start')],
+                'next': COMMITS_URL + '?page=3',
+            }),
+            match_querystring=True,
+        )
+        for sha in ('a', 'b', 'c'):
+            self.add_diffstat(sha)
+
+        commits = BitbucketClient().compare_commits('maxbittker/newsdiffs', 'start', 'c')
+
+        assert [c['hash'] for c in commits] == ['c', 'b', 'a']
+        assert [c['patch_set'] for c in commits] == [[], [], []]
+        # page 3 is never requested
+        assert len(responses.calls) == 5
+
+    @responses.activate
+    def test_get_commit_filechanges(self):
+        self.add_diffstat('a', [
+            {'status': 'modified', 'old': {'path': 'README.md'}, 'new': {'path': 'README.md'}},
+            {'status': 'added', 'old': None, 'new': {'path': 'setup.py'}},
+            {'status': 'removed', 'old': {'path': 'setup.cfg'}, 'new': None},
+            {'status': 'renamed', 'old': {'path': 'a.py'}, 'new': {'path': 'b.py'}},
+        ])
+
+        file_changes = BitbucketClient().get_commit_filechanges('maxbittker/newsdiffs', 'a')
+
+        assert file_changes == [
+            {'path': 'setup.py', 'type': 'A'},
+            {'path': 'setup.cfg', 'type': 'D'},
+            {'path': 'README.md', 'type': 'M'},
+            {'path': 'b.py', 'type': 'M'},
+        ]
+
+    @responses.activate
+    def test_compare_commits_max_pages(self):
+        responses.add(
+            responses.GET,
+            COMMITS_URL,
+            body=json.dumps({
+                'values': [make_commit('c')],
+                'next': COMMITS_URL + '?page=2',
+            }),
+            match_querystring=True,
+        )
+        self.add_diffstat('c')
+
+        client = BitbucketClient()
+        client.compare_commits_max_pages = 1
+        commits = client.compare_commits('maxbittker/newsdiffs', 'start', 'c')
+
+        assert [c['hash'] for c in commits] == ['c']
@@ -25,8 +25,8 @@ class BitbucketPluginTest(PluginTestCase):
         )
         responses.add(
             responses.GET,
-            'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/diff/e18e4e72de0d824edfbe0d73efe34cbd0d01d301',
-            body='',
+            'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/diffstat/e18e4e72de0d824edfbe0d73efe34cbd0d01d301',
+            body='{"values": []}',
         )
         repo = Repository.objects.create(
             provider='bitbucket',
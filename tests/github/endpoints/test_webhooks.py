@@ -5,16 +5,21 @@ import six
 
 from datetime import datetime
 from django.utils import timezone
+from mock import patch
 from sentry.models import (
     Commit,
     CommitAuthor,
+    CommitFileChange,
     Integration,
     OrganizationOption,
     PullRequest,
     Repository)
 from sentry.testutils import APITestCase
+from sentry.utils.cache import cache
 from uuid import uuid4
 
+from sentry_plugins.github.client import GitHubClient
+from sentry_plugins.github.endpoints.webhook import get_user_email_cache_key
 from sentry_plugins.github.testutils import (
     INSTALLATION_EVENT_EXAMPLE, INSTALLATION_REPO_EVENT, PUSH_EVENT_EXAMPLE,
     PUSH_EVENT_EXAMPLE_INSTALLATION, PULL_REQUEST_OPENED_EVENT_EXAMPLE,
@@ -109,16 +114,17 @@ class PushEventWebhookTest(APITestCase):
             name='baxterthehacker/public-repo',
         )
 
-        response = self.client.post(
-            path=url,
-            data=PUSH_EVENT_EXAMPLE,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='push',
-            HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='push',
+                HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         commit_list = list(
             Commit.objects.filter(
@@ -146,6 +152,88 @@ class PushEventWebhookTest(APITestCase):
         assert commit.author.external_id is None
         assert commit.date_added == datetime(2015, 5, 5, 23, 40, 15, tzinfo=timezone.utc)
 
+    def test_processed_in_background(self):
+        project = self.project  # force creation
+
+        url = '/plugins/github/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        secret = 'b3002c3e321d4b7880360d397db2ccfd'
+
+        OrganizationOption.objects.set_value(
+            organization=project.organization,
+            key='github:webhook_secret',
+            value=secret,
+        )
+
+        with patch('sentry_plugins.github.endpoints.webhook.process_webhook_event') as task:
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='push',
+                HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
+
+        assert response.status_code == 202
+        assert task.delay.call_count == 1
+        kwargs = task.delay.call_args[1]
+        assert kwargs['event_type'] == 'push'
+        assert kwargs['organization_id'] == project.organization_id
+        assert kwargs['integration'] is False
+        assert kwargs['event']['after'] == '0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c'
+
+    def test_file_changes_and_redelivery(self):
+        project = self.project  # force creation
+
+        url = '/plugins/github/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        secret = 'b3002c3e321d4b7880360d397db2ccfd'
+
+        OrganizationOption.objects.set_value(
+            organization=project.organization,
+            key='github:webhook_secret',
+            value=secret,
+        )
+
+        Repository.objects.create(
+            organization_id=project.organization.id,
+            external_id='35129377',
+            provider='github',
+            name='baxterthehacker/public-repo',
+        )
+
+        for _ in range(2):
+            with self.tasks():
+                response = self.client.post(
+                    path=url,
+                    data=PUSH_EVENT_EXAMPLE,
+                    content_type='application/json',
+                    HTTP_X_GITHUB_EVENT='push',
+                    HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
+                    HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+                )
+
+            assert response.status_code == 202
+
+        assert Commit.objects.filter(
+            organization_id=project.organization_id,
+        ).count() == 2
+
+        file_changes = list(
+            CommitFileChange.objects.filter(
+                organization_id=project.organization_id,
+            ).select_related('commit').order_by('commit__key')
+        )
+        assert [(f.commit.key, f.filename, f.type) for f in file_changes] == [
+            ('0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c', 'README.md', 'M'),
+            ('133d60480286590a610a0eb7352ff6e02b9674c4', 'README.md', 'M'),
+        ]
+
     def test_anonymous_lookup(self):
         project = self.project  # force creation
 
@@ -175,16 +263,17 @@ class PushEventWebhookTest(APITestCase):
             name=u'bàxterthehacker',
         )
 
-        response = self.client.post(
-            path=url,
-            data=PUSH_EVENT_EXAMPLE,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='push',
-            HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='push',
+                HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         commit_list = list(
             Commit.objects.filter(
@@ -211,6 +300,56 @@ class PushEventWebhookTest(APITestCase):
         assert commit.author.email == 'baxterthehacker@example.com'
         assert commit.date_added == datetime(2015, 5, 5, 23, 40, 15, tzinfo=timezone.utc)
 
+    def test_cached_anonymous_lookup(self):
+        project = self.project  # force creation
+
+        url = '/plugins/github/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        secret = 'b3002c3e321d4b7880360d397db2ccfd'
+
+        OrganizationOption.objects.set_value(
+            organization=project.organization,
+            key='github:webhook_secret',
+            value=secret,
+        )
+
+        Repository.objects.create(
+            organization_id=project.organization.id,
+            external_id='35129377',
+            provider='github',
+            name='baxterthehacker/public-repo',
+        )
+
+        cache_key = get_user_email_cache_key(project.organization_id, 'baxterthehacker')
+        cache.set(cache_key, 'baxterthehacker@example.com', 60)
+        self.addCleanup(cache.delete, cache_key)
+
+        with patch.object(GitHubClient, 'request_no_auth') as request_no_auth, self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='push',
+                HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
+
+        assert response.status_code == 202
+        assert not request_no_auth.called
+
+        commit_list = list(
+            Commit.objects.filter(
+                organization_id=project.organization_id,
+            ).select_related('author')
+        )
+
+        assert len(commit_list) == 2
+        for commit in commit_list:
+            assert commit.author.email == 'baxterthehacker@example.com'
+            assert commit.author.external_id == 'github:baxterthehacker'
+
 
 class InstallationPushEventWebhookTest(APITestCase):
     def test_simple(self):
@@ -233,16 +372,17 @@ class InstallationPushEventWebhookTest(APITestCase):
             name='baxterthehacker/public-repo',
         )
 
-        response = self.client.post(
-            path=url,
-            data=PUSH_EVENT_EXAMPLE_INSTALLATION,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='push',
-            HTTP_X_HUB_SIGNATURE='sha1=56a3df597e02adbc17fb617502c70e19d96a6136',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE_INSTALLATION,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='push',
+                HTTP_X_HUB_SIGNATURE='sha1=56a3df597e02adbc17fb617502c70e19d96a6136',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         commit_list = list(
             Commit.objects.filter(
@@ -270,21 +410,68 @@ class InstallationPushEventWebhookTest(APITestCase):
         assert commit.author.external_id is None
         assert commit.date_added == datetime(2015, 5, 5, 23, 40, 15, tzinfo=timezone.utc)
 
+    def test_multiple_organizations(self):
+        url = '/plugins/github/installations/webhook/'
+
+        inst = Integration.objects.create(
+            provider='github_apps',
+            external_id='12345',
+            name='dummyorg',
+        )
+
+        organizations = [self.create_organization() for _ in range(3)]
+        for org in organizations:
+            inst.add_organization(org.id)
+
+        # the last organization doesn't track this repository
+        for org in organizations[:2]:
+            Repository.objects.create(
+                organization_id=org.id,
+                external_id='35129377',
+                provider='github_apps',
+                name='baxterthehacker/public-repo',
+            )
+
+        with patch.object(GitHubClient, 'request_no_auth', return_value={'id': 1}) \
+                as request_no_auth, self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE_INSTALLATION,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='push',
+                HTTP_X_HUB_SIGNATURE='sha1=56a3df597e02adbc17fb617502c70e19d96a6136',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
+
+        assert response.status_code == 202
+        # the github user is only looked up once for the whole push
+        assert request_no_auth.call_count == 1
+
+        for org in organizations[:2]:
+            assert sorted(
+                Commit.objects.filter(organization_id=org.id).values_list('key', flat=True)
+            ) == [
+                '0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c',
+                '133d60480286590a610a0eb7352ff6e02b9674c4',
+            ]
+        assert not Commit.objects.filter(organization_id=organizations[2].id).exists()
+
 
 class InstallationInstallEventWebhookTest(APITestCase):
     def test_simple(self):
         url = '/plugins/github/installations/webhook/'
 
-        response = self.client.post(
-            path=url,
-            data=INSTALLATION_EVENT_EXAMPLE,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='installation',
-            HTTP_X_HUB_SIGNATURE='sha1=348e46312df2901e8cb945616ee84ce30d9987c9',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=INSTALLATION_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='installation',
+                HTTP_X_HUB_SIGNATURE='sha1=348e46312df2901e8cb945616ee84ce30d9987c9',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         assert Integration.objects.filter(
             provider='github_apps',
@@ -307,16 +494,17 @@ class InstallationRepoInstallEventWebhookTest(APITestCase):
 
         integration.add_organization(project.organization.id)
 
-        response = self.client.post(
-            path=url,
-            data=INSTALLATION_REPO_EVENT,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='installation_repositories',
-            HTTP_X_HUB_SIGNATURE='sha1=6899797a97dc5bb6aab3af927e92e881d03a3bd2',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=INSTALLATION_REPO_EVENT,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='installation_repositories',
+                HTTP_X_HUB_SIGNATURE='sha1=6899797a97dc5bb6aab3af927e92e881d03a3bd2',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         assert Repository.objects.filter(
             provider='github',
@@ -346,21 +534,65 @@ class InstallationRepoInstallEventWebhookTest(APITestCase):
         )
         assert 'name' not in repo.config
 
-        response = self.client.post(
-            path=url,
-            data=INSTALLATION_REPO_EVENT,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='installation_repositories',
-            HTTP_X_HUB_SIGNATURE='sha1=6899797a97dc5bb6aab3af927e92e881d03a3bd2',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=INSTALLATION_REPO_EVENT,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='installation_repositories',
+                HTTP_X_HUB_SIGNATURE='sha1=6899797a97dc5bb6aab3af927e92e881d03a3bd2',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         repo = Repository.objects.get(id=repo.id)
         assert repo.integration_id == integration.id
         assert repo.config['name'] == repo.name
 
+    def test_multiple_organizations(self):
+        url = '/plugins/github/installations/webhook/'
+
+        integration = Integration.objects.create(
+            provider='github_apps',
+            external_id='2',
+            name='octocat',
+        )
+
+        organizations = [self.create_organization() for _ in range(2)]
+        for org in organizations:
+            integration.add_organization(org.id)
+
+        Repository.objects.create(
+            provider='github',
+            name='octocat/Hello-World',
+            external_id=1296269,
+            organization_id=organizations[0].id,
+            config={'name': 'octocat/Hello-World'},
+        )
+
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=INSTALLATION_REPO_EVENT,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='installation_repositories',
+                HTTP_X_HUB_SIGNATURE='sha1=6899797a97dc5bb6aab3af927e92e881d03a3bd2',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
+
+        assert response.status_code == 202
+
+        for org in organizations:
+            repo = Repository.objects.get(
+                provider='github',
+                external_id=1296269,
+                organization_id=org.id,
+            )
+            assert repo.name == 'octocat/Hello-World'
+            assert repo.integration_id == integration.id
+            assert repo.config['name'] == 'octocat/Hello-World'
+
 
 class PullRequestEventWebhook(APITestCase):
     def test_opened(self):
@@ -385,16 +617,17 @@ class PullRequestEventWebhook(APITestCase):
             name='baxterthehacker/public-repo',
         )
 
-        response = self.client.post(
-            path=url,
-            data=PULL_REQUEST_OPENED_EVENT_EXAMPLE,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='pull_request',
-            HTTP_X_HUB_SIGNATURE='sha1=aa5b11bc52b9fac082cb59f9ee8667cb222c3aff',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
+        with self.tasks():
+            response = self.client.post(
+                path=url,
+                data=PULL_REQUEST_OPENED_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='pull_request',
+                HTTP_X_HUB_SIGNATURE='sha1=aa5b11bc52b9fac082cb59f9ee8667cb222c3aff',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
 
-        assert response.status_code == 204
+        assert response.status_code == 202
 
         prs = PullRequest.objects.filter(
             repository_id=repo.id,
@@ -432,25 +665,26 @@ class PullRequestEventWebhook(APITestCase):
             name='baxterthehacker/public-repo',
         )
 
-        self.client.post(
-            path=url,
-            data=PULL_REQUEST_OPENED_EVENT_EXAMPLE,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='pull_request',
-            HTTP_X_HUB_SIGNATURE='sha1=aa5b11bc52b9fac082cb59f9ee8667cb222c3aff',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
-
-        response = self.client.post(
-            path=url,
-            data=PULL_REQUEST_EDITED_EVENT_EXAMPLE,
-            content_type='application/json',
-            HTTP_X_GITHUB_EVENT='pull_request',
-            HTTP_X_HUB_SIGNATURE='sha1=b50a13afd33b514e8e62e603827ea62530f0690e',
-            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
-        )
-
-        assert response.status_code == 204
+        with self.tasks():
+            self.client.post(
+                path=url,
+                data=PULL_REQUEST_OPENED_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='pull_request',
+                HTTP_X_HUB_SIGNATURE='sha1=aa5b11bc52b9fac082cb59f9ee8667cb222c3aff',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
+
+            response = self.client.post(
+                path=url,
+                data=PULL_REQUEST_EDITED_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_GITHUB_EVENT='pull_request',
+                HTTP_X_HUB_SIGNATURE='sha1=b50a13afd33b514e8e62e603827ea62530f0690e',
+                HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+            )
+
+        assert response.status_code == 202
 
         prs = PullRequest.objects.filter(
             repository_id=repo.id,
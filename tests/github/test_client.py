@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+
+import responses
+
+from mock import patch
+from sentry.testutils import TestCase
+from sentry.utils import json
+
+from sentry_plugins.github.client import GitHubClient
+
+COMPARE_URL = 'https://api.github.com/repos/getsentry/example/compare/a...d'
+
+
+def make_commit(sha):
+    return {
+        'sha': sha,
+        'commit': {
+            'author': {'name': 'Monalisa Octocat', 'email': 'support@github.com'},
+            'message': 'commit %s' % sha,
+        },
+    }
+
+
+class GitHubClientTest(TestCase):
+    @responses.activate
+    def test_compare_commits_paginated(self):
+        responses.add(
+            responses.GET,
+            COMPARE_URL,
+            body=json.dumps({'commits': [make_commit('b'), make_commit('c')]}),
+            adding_headers={'Link': '<%s?page=2>; rel="next"' % COMPARE_URL},
+            match_querystring=True,
+        )
+        responses.add(
+            responses.GET,
+            COMPARE_URL + '?page=2',
+            body=json.dumps({'commits': [make_commit('d')]}),
+            match_querystring=True,
+        )
+
+        commits = GitHubClient().compare_commits('getsentry/example', 'a', 'd')
+
+        # nothing is fetched until the commits are needed
+        assert len(responses.calls) == 0
+        assert [c['sha'] for c in commits] == ['b', 'c', 'd']
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_compare_commits_max_pages(self):
+        responses.add(
+            responses.GET,
+            COMPARE_URL,
+            body=json.dumps({'commits': [make_commit('b')]}),
+            adding_headers={'Link': '<%s?page=2>; rel="next"' % COMPARE_URL},
+            match_querystring=True,
+        )
+
+        client = GitHubClient()
+        client.max_commit_pages = 1
+
+        with patch.object(client, 'logger') as logger:
+            assert [
+                c['sha'] for c in client.compare_commits('getsentry/example', 'a', 'd')
+            ] == ['b']
+
+        logger.warning.assert_called_once_with('github.pages-truncated', extra={
+            'next': COMPARE_URL + '?page=2',
+            'max_pages': 1,
+        })
+
+    def test_conditional_paths(self):
+        client = GitHubClient()
+        assert client.should_cache('GET', '/repos/getsentry/example')
+        assert client.should_cache('GET', '/repos/getsentry/example/assignees?per_page=100')
+        assert not client.should_cache('GET', '/repos/getsentry/example/compare/a...d')
+        assert not client.should_cache('GET', '/repos/getsentry/example/commits')
+        assert not client.should_cache('GET', COMPARE_URL + '?page=2')
+        assert not client.should_cache('POST', '/repos/getsentry/example')
@@ -136,7 +136,7 @@ class GitHubAppsProviderTest(PluginTestCase):
     @patch.object(
         GitHubAppsClient,
         'compare_commits',
-        return_value={'commits': []}
+        return_value=iter([])
     )
     def test_compare_commits(self, mock_compare_commits):
         organization = self.create_organization()
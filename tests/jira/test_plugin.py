@@ -9,6 +9,7 @@ from django.test import RequestFactory
 from sentry.testutils import TestCase
 from sentry.utils import json
 
+from sentry_plugins.jira.client import JiraClient
 from sentry_plugins.jira.plugin import JiraPlugin
 
 create_meta_response = {
@@ -379,3 +380,13 @@ class JiraPluginTest(TestCase):
             'id': 'robot',
             'text': 'robot (robot)'
         }
+
+    def test_conditional_paths(self):
+        client = JiraClient('https://getsentry.atlassian.net', 'user', 'pass')
+        assert client.should_cache('GET', JiraClient.META_URL)
+        assert client.should_cache('GET', JiraClient.PROJECT_URL)
+        assert client.should_cache('GET', JiraClient.PRIORITIES_URL)
+        assert client.should_cache('GET', JiraClient.VERSIONS_URL % 'SEN')
+        assert not client.should_cache('GET', JiraClient.ISSUE_URL % 'SEN-19')
+        assert not client.should_cache('GET', JiraClient.SEARCH_URL)
+        assert not client.should_cache('GET', JiraClient.USERS_URL)
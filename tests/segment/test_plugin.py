@@ -75,3 +75,39 @@ class SegmentPluginTest(PluginTestCase):
             },
             'timestamp': event.datetime.isoformat() + 'Z',
         } == payload
+
+    @responses.activate
+    def test_batched_notification(self):
+        responses.add(responses.POST, 'https://api.segment.io/v1/batch')
+
+        self.plugin.set_option('write_key', 'secret-api-key', self.project)
+        self.plugin.set_option('batch', True, self.project)
+
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        events = [
+            self.create_event(
+                group=group,
+                data={
+                    'sentry.interfaces.User': {
+                        'id': '1',
+                        'email': 'foo@example.com',
+                    },
+                    'type': 'error',
+                },
+                tags={'level': 'warning'},
+            ) for _ in range(2)
+        ]
+
+        with self.options({'system.url-prefix': 'http://example.com'}):
+            for event in events:
+                self.plugin.post_process(event)
+
+        assert len(responses.calls) == 0
+
+        self.plugin.buffer.flush()
+
+        assert len(responses.calls) == 1
+        payload = json.loads(responses.calls[0].request.body)
+        assert [m['properties']['eventId'] for m in payload['batch']] == \
+            [e.event_id for e in events]
+        assert all(m['type'] == 'track' for m in payload['batch'])
@@ -2,9 +2,14 @@ from __future__ import absolute_import
 
 import responses
 
+from django.core.cache.backends.locmem import LocMemCache
 from exam import fixture
+from mock import patch
 from sentry.testutils import PluginTestCase
 
+from sentry_plugins.sessionstack.client import (
+    LookupTimeoutError, SessionStackClient, circuit_breaker, local_cache
+)
 from sentry_plugins.sessionstack.plugin import SessionStackPlugin
 
 EXPECTED_SESSION_URL = (
@@ -23,6 +28,19 @@ class SessionStackPluginTest(PluginTestCase):
     def plugin(self):
         return SessionStackPlugin()
 
+    def setUp(self):
+        super(SessionStackPluginTest, self).setUp()
+        # lookups are cached, so each test gets caches of its own
+        patcher = patch(
+            'sentry_plugins.sessionstack.client.cache',
+            LocMemCache('sessionstack-tests', {}),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        local_cache.clear()
+        self.addCleanup(local_cache.clear)
+        self.addCleanup(circuit_breaker.record_success, u'https://api.sessionstack.com:0')
+
     def test_conf_key(self):
         assert self.plugin.conf_key == 'sessionstack'
 
@@ -91,3 +109,122 @@ class SessionStackPluginTest(PluginTestCase):
         session_url = sessionstack_context.get('session_url')
 
         assert session_url == EXPECTED_SESSION_URL
+
+    @responses.activate
+    def test_event_preprocessing_cached(self):
+        responses.add(
+            responses.POST,
+            ACCESS_TOKENS_URL,
+            json={'access_token': 'example-access-token'},
+        )
+
+        self.plugin.enable(self.project)
+        self.plugin.set_option('account_email', 'user@example.com', self.project)
+        self.plugin.set_option('api_token', 'example-api-token', self.project)
+        self.plugin.set_option('website_id', 0, self.project)
+
+        for _ in range(2):
+            event = {
+                'project': self.project.id,
+                'contexts': {
+                    'sessionstack': {
+                        'session_id': '588778a6c5762c1d566653ff',
+                        'type': 'sessionstack'
+                    }
+                },
+                'platform': 'javascript'
+            }
+            processed_event = self.plugin.get_event_preprocessors(event)[0](event)
+            session_url = processed_event['contexts']['sessionstack']['session_url']
+            assert session_url == EXPECTED_SESSION_URL
+
+        assert len(responses.calls) == 1
+
+    @patch(
+        'sentry_plugins.sessionstack.client.SessionStackClient.get_session_url',
+        side_effect=LookupTimeoutError,
+    )
+    def test_event_preprocessing_timeout(self, mock_get_session_url):
+        self.plugin.enable(self.project)
+        self.plugin.set_option('account_email', 'user@example.com', self.project)
+        self.plugin.set_option('api_token', 'example-api-token', self.project)
+        self.plugin.set_option('website_id', 0, self.project)
+
+        event = {
+            'project': self.project.id,
+            'contexts': {
+                'sessionstack': {
+                    'session_id': '588778a6c5762c1d566653ff',
+                    'type': 'sessionstack'
+                }
+            },
+            'platform': 'javascript'
+        }
+        processed_event = self.plugin.get_event_preprocessors(event)[0](event)
+
+        assert 'session_url' not in processed_event['contexts']['sessionstack']
+
+    @responses.activate
+    def test_cache_keyed_by_credentials(self):
+        responses.add(
+            responses.POST,
+            ACCESS_TOKENS_URL,
+            json={'access_token': 'example-access-token'},
+        )
+
+        for api_token in ('example-api-token', 'other-api-token', 'example-api-token'):
+            client = SessionStackClient('user@example.com', api_token, 0)
+            assert client.get_session_url('588778a6c5762c1d566653ff', None) == \
+                EXPECTED_SESSION_URL
+
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_event_preprocessing_negative_cache(self):
+        responses.add(responses.POST, ACCESS_TOKENS_URL, status=404)
+        responses.add(responses.GET, ACCESS_TOKENS_URL, status=404)
+
+        self.plugin.enable(self.project)
+        self.plugin.set_option('account_email', 'user@example.com', self.project)
+        self.plugin.set_option('api_token', 'example-api-token', self.project)
+        self.plugin.set_option('website_id', 0, self.project)
+
+        for _ in range(2):
+            event = {
+                'project': self.project.id,
+                'contexts': {
+                    'sessionstack': {
+                        'session_id': '588778a6c5762c1d566653ff',
+                        'type': 'sessionstack'
+                    }
+                },
+                'platform': 'javascript'
+            }
+            self.plugin.get_event_preprocessors(event)[0](event)
+
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_event_preprocessing_circuit_open(self):
+        for _ in range(circuit_breaker.failure_threshold):
+            circuit_breaker.record_failure(u'https://api.sessionstack.com:0')
+
+        self.plugin.enable(self.project)
+        self.plugin.set_option('account_email', 'user@example.com', self.project)
+        self.plugin.set_option('api_token', 'example-api-token', self.project)
+        self.plugin.set_option('website_id', 0, self.project)
+
+        event = {
+            'project': self.project.id,
+            'contexts': {
+                'sessionstack': {
+                    'session_id': '588778a6c5762c1d566653ff',
+                    'type': 'sessionstack'
+                }
+            },
+            'platform': 'javascript'
+        }
+        processed_event = self.plugin.get_event_preprocessors(event)[0](event)
+
+        assert 'session_url' not in processed_event['contexts']['sessionstack']
+        assert len(responses.calls) == 0
@@ -1,8 +1,10 @@
 from __future__ import absolute_import
 
 import responses
+import six
 
 from exam import fixture
+from json import JSONDecoder
 from sentry.testutils import PluginTestCase
 from sentry.utils import json
 
@@ -63,3 +65,39 @@ class SplunkPluginTest(PluginTestCase):
         }
         headers = request.headers
         assert headers['Authorization'] == 'Splunk 12345678-1234-1234-1234-1234567890AB'
+
+    @responses.activate
+    def test_batched_notification(self):
+        responses.add(responses.POST, 'https://splunk.example.com:8088/services/collector')
+
+        self.plugin.set_option('token', '12345678-1234-1234-1234-1234567890AB', self.project)
+        self.plugin.set_option('index', 'main', self.project)
+        self.plugin.set_option('instance', 'https://splunk.example.com:8088', self.project)
+        self.plugin.set_option('batch', True, self.project)
+
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        events = [
+            self.create_event(group=group, message='Hello world', tags={'level': 'warning'})
+            for _ in range(3)
+        ]
+
+        with self.options({'system.url-prefix': 'http://example.com'}):
+            for event in events:
+                self.plugin.post_process(event)
+
+        assert len(responses.calls) == 0
+
+        self.plugin.buffer.flush()
+
+        assert len(responses.calls) == 1
+        request = responses.calls[0].request
+        body = request.body
+        if isinstance(body, six.binary_type):
+            body = body.decode('utf-8')
+        decoder = JSONDecoder()
+        payloads = []
+        while body:
+            payload, end = decoder.raw_decode(body)
+            payloads.append(payload)
+            body = body[end:]
+        assert [p['event']['event_id'] for p in payloads] == [e.event_id for e in events]
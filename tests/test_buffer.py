@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+
+import threading
+
+from sentry.testutils import TestCase
+
+from sentry_plugins.buffer import BatchBuffer, PartialFlushError
+
+
+class BatchBufferTest(TestCase):
+    def setUp(self):
+        self.flushed = []
+        self.flushed_event = threading.Event()
+
+    def flush_func(self, key, items):
+        self.flushed.append((key, list(items)))
+        self.flushed_event.set()
+
+    def test_flush_on_count(self):
+        buffer = BatchBuffer(self.flush_func, max_count=2, max_delay=60)
+        buffer.append('a', 'foo')
+        buffer.append('b', 'foo')
+        assert self.flushed == []
+
+        buffer.append('a', 'bar')
+        # full batches are sent by the background thread
+        assert self.flushed_event.wait(5)
+        assert self.flushed == [('a', ['foo', 'bar'])]
+
+    def test_flush_on_bytes(self):
+        buffer = BatchBuffer(self.flush_func, max_bytes=5, max_delay=60)
+        buffer.append('a', 'foo')
+        buffer.append('a', 'bar')
+        assert self.flushed_event.wait(5)
+        assert self.flushed == [('a', ['foo'])]
+
+        buffer.flush()
+        assert self.flushed == [('a', ['foo']), ('a', ['bar'])]
+
+    def test_retry(self):
+        attempts = []
+
+        def flush_func(key, items):
+            attempts.append(list(items))
+            self.flushed_event.set()
+            if len(attempts) == 1:
+                raise ValueError()
+
+        buffer = BatchBuffer(
+            flush_func,
+            max_count=1,
+            should_retry=lambda exc: isinstance(exc, ValueError),
+            retry_delay=60,
+        )
+        buffer.append('a', 'foo')
+        assert self.flushed_event.wait(5)
+        # the retry is scheduled for later rather than done straight away
+        assert attempts == [['foo']]
+
+        buffer.flush()
+        assert attempts == [['foo'], ['foo']]
+
+    def test_partial_retry(self):
+        attempts = []
+
+        def flush_func(key, items):
+            attempts.append(list(items))
+            self.flushed_event.set()
+            if len(attempts) == 1:
+                raise PartialFlushError(items[1:])
+
+        buffer = BatchBuffer(
+            flush_func,
+            max_count=2,
+            should_retry=lambda exc: isinstance(exc, PartialFlushError),
+            retry_delay=60,
+        )
+        buffer.append('a', 'foo')
+        buffer.append('a', 'bar')
+        assert self.flushed_event.wait(5)
+        assert attempts == [['foo', 'bar']]
+
+        # flushing a single key sends its retries as well
+        buffer.flush('b')
+        assert attempts == [['foo', 'bar']]
+        buffer.flush('a')
+        assert attempts == [['foo', 'bar'], ['bar']]
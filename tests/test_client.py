@@ -2,14 +2,22 @@ from __future__ import absolute_import
 
 import pytest
 import responses
+import six
+import time
 
-from mock import Mock
+from mock import Mock, patch
+from requests.exceptions import ReadTimeout
 from sentry.testutils import TestCase
 
 from sentry_plugins.exceptions import (
-    ApiError, ApiHostError, ApiUnauthorized, UnsupportedResponseType
+    ApiError, ApiHostError, ApiRateLimitedError, ApiTimeoutError, ApiUnauthorized,
+    UnsupportedResponseType
 )
-from sentry_plugins.client import ApiClient, AuthApiClient
+from sentry_plugins.client import (
+    ApiClient, AuthApiClient, MappingApiResponse, RateLimit, RateLimitTracker, RetryPolicy,
+    SessionPool,
+)
+from sentry_plugins.utils import Deadline, LocalCache
 
 
 class ApiClientTest(TestCase):
@@ -20,6 +28,38 @@ class ApiClientTest(TestCase):
         resp = ApiClient().get('http://example.com')
         assert resp.status_code == 200
 
+    @responses.activate
+    def test_declared_charset(self):
+        responses.add(
+            responses.GET,
+            'http://example.com',
+            body=u'{"name": "Jos\xe9"}'.encode('latin-1'),
+            content_type='application/json; charset=ISO-8859-1',
+        )
+
+        resp = ApiClient().get('http://example.com')
+        assert resp['name'] == u'Jos\xe9'
+
+    @responses.activate
+    def test_ordered_json(self):
+        responses.add(
+            responses.GET,
+            'http://example.com',
+            body='{"b": {"d": 1, "c": 2}, "a": 3}',
+            content_type='application/json',
+        )
+
+        resp = ApiClient().get('http://example.com')
+        assert resp == {'a': 3, 'b': {'c': 2, 'd': 1}}
+
+        resp = ApiClient().get('http://example.com', ordered_json=True)
+        assert list(resp['b']) == ['d', 'c']
+
+        client = ApiClient()
+        client.ordered_json = True
+        resp = client.get('http://example.com')
+        assert list(resp['b']) == ['d', 'c']
+
     @responses.activate
     def test_post(self):
         responses.add(responses.POST, 'http://example.com', json={})
@@ -48,6 +88,256 @@ class ApiClientTest(TestCase):
         resp = ApiClient().patch('http://example.com')
         assert resp.status_code == 200
 
+    @responses.activate
+    def test_reuses_session(self):
+        responses.add(responses.GET, 'http://example.com/foo', json={})
+        responses.add(responses.GET, 'http://example.com/bar', json={})
+
+        client = ApiClient()
+        client.session_pool = pool = SessionPool()
+        client.get('http://example.com/foo')
+        client.get('http://example.com/bar')
+
+        assert len(pool._sessions) == 1
+        assert not responses.calls[-1].request.headers.get('Cookie')
+
+    @responses.activate
+    def test_conditional_request(self):
+        responses.add(
+            responses.GET, 'http://example.com', json={'foo': 'bar'},
+            adding_headers={'ETag': '"abc"'},
+        )
+        responses.add(responses.GET, 'http://example.com', status=304)
+
+        client = ApiClient()
+        client.conditional_requests = True
+        client.response_cache = LocalCache()
+
+        resp = client.get('http://example.com', params={'a': '1'})
+        assert resp == {'foo': 'bar'}
+        assert 'If-None-Match' not in responses.calls[0].request.headers
+
+        resp['foo'] = 'baz'
+        resp = client.get('http://example.com', params={'a': '1'})
+        assert isinstance(resp, MappingApiResponse)
+        assert resp == {'foo': 'bar'}
+        assert responses.calls[1].request.headers['If-None-Match'] == '"abc"'
+
+    @responses.activate
+    def test_conditional_request_keyed_by_auth(self):
+        responses.add(
+            responses.GET, 'http://example.com', json={'foo': 'bar'},
+            adding_headers={'ETag': '"abc"'},
+        )
+
+        client = ApiClient()
+        client.conditional_requests = True
+        client.response_cache = LocalCache()
+
+        client.get('http://example.com', headers={'Authorization': 'Bearer a'})
+        client.get('http://example.com', headers={'Authorization': 'Bearer b'})
+        assert 'If-None-Match' not in responses.calls[1].request.headers
+
+    @responses.activate
+    def test_conditional_request_max_size(self):
+        responses.add(
+            responses.GET, 'http://example.com', json={'foo': 'bar'},
+            adding_headers={'ETag': '"abc"'},
+        )
+
+        client = ApiClient()
+        client.conditional_requests = True
+        client.conditional_cache_max_size = 8
+        client.response_cache = LocalCache()
+
+        client.get('http://example.com')
+        client.get('http://example.com')
+        assert 'If-None-Match' not in responses.calls[1].request.headers
+
+    @responses.activate
+    def test_rate_limited(self):
+        responses.add(
+            responses.GET, 'http://example.com', json={},
+            adding_headers={
+                'X-RateLimit-Limit': '60',
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset': six.text_type(int(time.time()) + 60),
+            },
+        )
+
+        client = ApiClient()
+        client.rate_limits = RateLimitTracker()
+        client.get('http://example.com')
+        assert client.rate_limit.limit == 60
+        assert client.rate_limit.remaining == 0
+
+        with pytest.raises(ApiRateLimitedError):
+            client.get('http://example.com')
+        assert len(responses.calls) == 1
+
+        # other credentials have their own budget
+        client.get('http://example.com', headers={'Authorization': 'Bearer a'})
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    @patch('sentry_plugins.client.time.sleep')
+    def test_background_request_waits(self, sleep):
+        responses.add(
+            responses.GET, 'http://example.com', json={},
+            adding_headers={'Retry-After': '5'},
+        )
+
+        client = ApiClient()
+        client.rate_limits = RateLimitTracker()
+        client.interactive = False
+        client.get('http://example.com')
+        assert not sleep.called
+
+        client.get('http://example.com')
+        assert sleep.call_count == 1
+        assert 0 < sleep.call_args[0][0] <= 5
+
+        client.max_rate_limit_wait = 1
+        with pytest.raises(ApiRateLimitedError):
+            client.get('http://example.com')
+
+    @responses.activate
+    @patch('sentry_plugins.client.time.sleep')
+    def test_retry(self, sleep):
+        responses.add(responses.GET, 'http://example.com', status=503)
+        responses.add(responses.GET, 'http://example.com', status=502)
+        responses.add(responses.GET, 'http://example.com', json={})
+
+        resp = ApiClient().get('http://example.com')
+        assert resp.status_code == 200
+        assert len(responses.calls) == 3
+        assert sleep.call_count == 2
+
+    @responses.activate
+    @patch('sentry_plugins.client.time.sleep')
+    def test_retry_gives_up(self, sleep):
+        responses.add(responses.GET, 'http://example.com', status=503)
+
+        client = ApiClient()
+        client.retry_policy = RetryPolicy(max_retries=1)
+        with pytest.raises(ApiError):
+            client.get('http://example.com')
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    @patch('sentry_plugins.client.time.sleep')
+    def test_no_retry(self, sleep):
+        responses.add(responses.POST, 'http://example.com', status=503)
+        responses.add(responses.GET, 'http://example.com', status=500)
+
+        with pytest.raises(ApiError):
+            ApiClient().post('http://example.com')
+        with pytest.raises(ApiError):
+            ApiClient().get('http://example.com')
+        assert len(responses.calls) == 2
+        assert not sleep.called
+
+    @responses.activate
+    def test_timeout(self):
+        responses.add(responses.GET, 'http://example.com', body=ReadTimeout())
+
+        with pytest.raises(ApiTimeoutError):
+            ApiClient().get('http://example.com')
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_deadline(self):
+        responses.add(responses.GET, 'http://example.com', json={})
+
+        client = ApiClient()
+        client.deadline = Deadline(0)
+        with pytest.raises(ApiTimeoutError):
+            client.get('http://example.com')
+        assert len(responses.calls) == 0
+
+        client.deadline = Deadline(10)
+        connect_timeout, read_timeout = client.get_timeout('http://example.com')
+        assert connect_timeout == 5
+        assert 9 < read_timeout <= 10
+        client.get('http://example.com')
+        assert len(responses.calls) == 1
+
+    def test_set_background(self):
+        client = ApiClient()
+        client.set_background()
+        assert not client.interactive
+        assert client.background_timeout - 1 < client.deadline.remaining()
+
+
+class SessionPoolTest(TestCase):
+    def test_keyed_by_host_and_transport(self):
+        pool = SessionPool()
+        session = pool.get('https://example.com/foo')
+        assert pool.get('https://example.com/bar') is session
+        assert pool.get('https://example.com/bar', verify_ssl=False) is not session
+        assert pool.get('https://example.org/foo') is not session
+        assert pool.get(
+            'https://example.com/foo',
+            proxies={'https': 'http://proxy.example.com'},
+        ) is not session
+
+    def test_max_sessions(self):
+        pool = SessionPool(max_sessions=2)
+        session = pool.get('https://example.com')
+        pool.get('https://example.org')
+        with patch.object(session, 'close') as close:
+            pool.get('https://example.net')
+        # another thread may still be using it
+        assert not close.called
+
+        assert len(pool._sessions) == 2
+        assert pool.get('https://example.com') is not session
+
+    def test_idle_timeout(self):
+        pool = SessionPool(idle_timeout=0)
+        session = pool.get('https://example.com')
+        with patch('sentry_plugins.client.time.time', return_value=time.time() + 1), \
+                patch.object(session, 'close') as close:
+            assert pool.get('https://example.com') is not session
+        assert close.called
+
+    def test_fork(self):
+        pool = SessionPool()
+        session = pool.get('https://example.com')
+        with patch('sentry_plugins.client.os.getpid', return_value=-1):
+            assert pool.get('https://example.com') is not session
+
+
+class RateLimitTest(TestCase):
+    def test_from_headers(self):
+        rate_limit = RateLimit.from_headers({
+            'X-RateLimit-Limit': '5000',
+            'X-RateLimit-Remaining': '4999',
+            'X-RateLimit-Reset': '1500000000',
+        }, now=1499999000)
+        assert rate_limit.limit == 5000
+        assert rate_limit.remaining == 4999
+        assert rate_limit.reset_at == 1500000000
+        assert rate_limit.retry_at is None
+
+        assert RateLimit.from_headers({'Content-Type': 'application/json'}) is None
+
+    def test_retry_after(self):
+        rate_limit = RateLimit.from_headers({'Retry-After': '120'}, now=1000)
+        assert rate_limit.retry_at == 1120
+        assert rate_limit.get_wait(now=1100) == 20
+
+        rate_limit = RateLimit.from_headers(
+            {'Retry-After': 'Fri, 14 Jul 2017 02:40:00 GMT'}, now=1000,
+        )
+        assert rate_limit.retry_at == 1500000000
+
+    def test_get_wait(self):
+        rate_limit = RateLimit(limit=100, remaining=5, reset_at=1060)
+        assert rate_limit.get_wait(now=1000) == 0
+        assert rate_limit.get_wait(reserve=10, now=1000) == 60
+        assert rate_limit.get_wait(reserve=10, now=1100) == 0
+
 
 class AuthApiClientTest(TestCase):
     @responses.activate
@@ -91,9 +381,11 @@ class AuthApiClientTest(TestCase):
         assert not request.headers.get('Authorization')
 
     @responses.activate
-    def test_invalid_host(self):
+    @patch('sentry_plugins.client.time.sleep')
+    def test_invalid_host(self, sleep):
         with pytest.raises(ApiHostError):
             AuthApiClient().get('http://example.com')
+        assert sleep.call_count == 2
 
     @responses.activate
     def test_unauthorized(self):
@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+
+from sentry.models import CommitAuthor
+from sentry.testutils import TestCase
+
+from sentry_plugins.commits import CommitAuthorResolver
+
+
+class CommitAuthorResolverTest(TestCase):
+    def test_updates_existing_authors(self):
+        org = self.create_organization()
+        for email in ('a@example.com', 'b@example.com'):
+            CommitAuthor.objects.create(organization_id=org.id, email=email, name='old')
+        CommitAuthor.objects.create(organization_id=org.id, email='c@example.com', name='C')
+
+        resolver = CommitAuthorResolver(org.id)
+        resolver.add('a@example.com', 'Jane')
+        resolver.add('b@example.com', 'Jane')
+        resolver.add('c@example.com', 'C', external_id='github:c')
+        resolver.add('d@example.com', 'D')
+        authors = resolver.resolve()
+
+        assert sorted(authors) == [
+            'a@example.com', 'b@example.com', 'c@example.com', 'd@example.com',
+        ]
+        assert authors['a@example.com'].name == 'Jane'
+        assert authors['c@example.com'].external_id == 'github:c'
+
+        assert sorted(
+            CommitAuthor.objects.filter(organization_id=org.id).values_list(
+                'email', 'name', 'external_id',
+            )
+        ) == [
+            ('a@example.com', 'Jane', None),
+            ('b@example.com', 'Jane', None),
+            ('c@example.com', 'C', 'github:c'),
+            ('d@example.com', 'D', None),
+        ]
+
+    def test_keeps_existing_authors(self):
+        org = self.create_organization()
+        CommitAuthor.objects.create(organization_id=org.id, email='a@example.com', name='old')
+
+        resolver = CommitAuthorResolver(org.id, update_existing=False)
+        resolver.add('a@example.com', 'Jane')
+        resolver.resolve()
+
+        assert CommitAuthor.objects.get(
+            organization_id=org.id,
+            email='a@example.com',
+        ).name == 'old'
+
+    def test_taken_external_id(self):
+        org = self.create_organization()
+        CommitAuthor.objects.create(
+            organization_id=org.id, email='a@example.com', name='A', external_id='github:a',
+        )
+
+        resolver = CommitAuthorResolver(org.id)
+        resolver.add('b@example.com', 'B', external_id='github:a')
+        resolver.add('c@example.com', 'C', external_id='github:c')
+        authors = resolver.resolve()
+
+        assert authors['b@example.com'].external_id is None
+        assert authors['c@example.com'].external_id == 'github:c'
+        assert CommitAuthor.objects.get(
+            organization_id=org.id,
+            email='c@example.com',
+        ).external_id == 'github:c'
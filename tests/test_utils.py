@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import pytest
+import six
+import time
+
+from mock import patch
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+
+from sentry_plugins.utils import (
+    CircuitBreaker, Deadline, DeadlineExceeded, EncodedPayload, EventSummary, LocalCache
+)
+
+
+class EncodedPayloadTest(TestCase):
+    def test_size(self):
+        message = EncodedPayload({'foo': u'☃'})
+        assert isinstance(message.data, six.binary_type)
+        assert json.loads(message.data) == {'foo': u'☃'}
+        assert message.size == len(message) == len(message.data)
+
+
+class EventSummaryTest(TestCase):
+    def test_shared_per_event(self):
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        event = self.create_event(
+            group=group,
+            data={
+                'sentry.interfaces.Exception': {
+                    'type': 'ValueError',
+                    'value': 'foo bar',
+                },
+                'sentry.interfaces.Http': {
+                    'url': 'http://example.com/foo',
+                    'method': 'GET',
+                    'headers': [['Referer', 'http://example.com']],
+                },
+            },
+            tags={'environment': 'prod', 'sentry:release': '1.0'},
+        )
+
+        summary = EventSummary.for_event(event)
+        assert EventSummary.for_event(event) is summary
+        assert summary.environment == 'prod'
+        assert summary.release == '1.0'
+        assert summary.transaction == ''
+        assert summary.exception.type == 'ValueError'
+        assert summary.http['referer'] == 'http://example.com'
+        assert summary.user is None
+
+
+class LocalCacheTest(TestCase):
+    def test_lru(self):
+        cache = LocalCache(max_size=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        assert cache.get('a') == 1
+        cache.set('c', 3, 60)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+    def test_ttl(self):
+        cache = LocalCache()
+        cache.set('a', 1, -1)
+        assert cache.get('a') is None
+
+    def test_max_bytes(self):
+        cache = LocalCache(max_bytes=10)
+        cache.set('a', 1, 60, size=4)
+        cache.set('b', 2, 60, size=4)
+        assert cache.get('a') == 1
+        cache.set('c', 3, 60, size=4)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+        # entries larger than the whole cache aren't kept
+        cache.set('d', 4, 60, size=11)
+        assert cache.get('d') is None
+        assert cache.get('a') == 1
+
+
+class CircuitBreakerTest(TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure('a')
+        assert not breaker.is_open('a')
+        breaker.record_failure('a')
+        assert breaker.is_open('a')
+        assert not breaker.is_open('b')
+
+        breaker.record_success('a')
+        assert not breaker.is_open('a')
+
+    def test_reset_timeout(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure('a')
+        assert not breaker.is_open('a')
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure('a')
+        breaker.record_failure('a')
+        assert breaker.is_open('a')
+
+        with patch('sentry_plugins.utils.time.time', return_value=time.time() + 61):
+            # only one trial call is let through
+            assert not breaker.is_open('a')
+            assert breaker.is_open('a')
+
+            # and its failure reopens the breaker straight away
+            breaker.record_failure('a')
+            assert breaker.is_open('a')
+
+        with patch('sentry_plugins.utils.time.time', return_value=time.time() + 122):
+            assert not breaker.is_open('a')
+            breaker.record_success('a')
+            assert not breaker.is_open('a')
+            assert not breaker.is_open('a')
+
+
+class DeadlineTest(TestCase):
+    def test_get_timeout(self):
+        deadline = Deadline(10)
+        assert 9 < deadline.remaining() <= 10
+
+        connect_timeout, read_timeout = deadline.get_timeout(5, 30)
+        assert connect_timeout == 5
+        assert 9 < read_timeout <= 10
+
+    def test_expired(self):
+        deadline = Deadline(0)
+        assert deadline.remaining() == 0
+        with pytest.raises(DeadlineExceeded):
+            deadline.get_timeout(5, 30)